@@ -0,0 +1,373 @@
+"""Local stand-ins for the SoundCloud API and VLC's http interface
+
+Both servers answer just enough of the real APIs for silverlining to run
+against them. Every request sleeps for latency seconds first, and fails
+with a 503 with probability failure_rate, so slow or flaky networks can be
+emulated.
+"""
+import json
+import random
+import re
+import threading
+import time
+import xml.etree.ElementTree as ET
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs, urlencode, urlparse
+
+
+WORDS = ('patience', 'silver', 'lining', 'night', 'drive', 'echo', 'static',
+         'ocean', 'neon', 'velvet', 'ember', 'signal', 'hollow', 'arc')
+# silverlining's own playlist, found in /me/playlists
+SILVERLINING_PLAYLIST_ID = 1
+
+
+class FakeServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, handler, latency=0.0, failure_rate=0.0):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), handler)
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.requests = 0
+        self._thread = None
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%s' % self.server_port
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class FakeHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # headers and body go out in separate writes, without TCP_NODELAY each
+    # keep-alive response stalls on Nagle and the client's delayed ACK
+    disable_nagle_algorithm = True
+
+    def handle_one(self, method):
+        self.server.requests += 1
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        length = int(self.headers.get('Content-Length') or 0)
+        self.body = self.rfile.read(length) if length else b''
+        if random.random() < self.server.failure_rate:
+            self.send_json({'error': 'injected failure'}, 503)
+            return
+        url = urlparse(self.path)
+        self.query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        self.route(method, re.sub(r'\.json$', '', url.path))
+
+    def do_GET(self):
+        self.handle_one('GET')
+
+    def do_POST(self):
+        self.handle_one('POST')
+
+    def do_PUT(self):
+        self.handle_one('PUT')
+
+    def send_json(self, data, status=200):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_redirect(self, location):
+        self.send_response(302)
+        self.send_header('Location', location)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class Catalogue(object):
+    """Deterministic users, tracks and playlists for the fake API"""
+    def __init__(self, url, users=20, tracks_per_user=100, playlists_per_user=5):
+        self.url = url
+        rand = random.Random(0)
+        self.users = {}
+        self.tracks = {}
+        self.playlists = {}
+        for u in range(1, users + 1):
+            user_id = 100 + u
+            self.users[user_id] = {
+                'id': user_id,
+                'kind': 'user',
+                'username': 'user%s' % u,
+                'full_name': 'User %s' % u,
+                'permalink_url': 'https://soundcloud.com/user%s' % u,
+            }
+            for t in range(tracks_per_user):
+                track_id = user_id * 10000 + t
+                title = ' '.join(rand.sample(WORDS, 3))
+                self.tracks[track_id] = {
+                    'id': track_id,
+                    'kind': 'track',
+                    'title': title,
+                    'user': {'id': user_id, 'username': 'user%s' % u},
+                    'user_id': user_id,
+                    'stream_url': '%s/tracks/%s/stream' % (url, track_id),
+                    'permalink_url': 'https://soundcloud.com/user%s/%s' % (
+                        u, title.replace(' ', '-')),
+                    'duration': rand.randint(120, 600) * 1000,
+                    'tag_list': ' '.join(rand.sample(WORDS, 2)),
+                    'created_at': '2014/01/01 00:%02d:%02d +0000' % divmod(t % 3600, 60),
+                }
+            for p in range(playlists_per_user):
+                playlist_id = user_id * 100 + p
+                self.playlists[playlist_id] = {
+                    'id': playlist_id,
+                    'kind': 'playlist',
+                    'title': ' '.join(rand.sample(WORDS, 2)),
+                    'user': {'id': user_id, 'username': 'user%s' % u},
+                    'user_id': user_id,
+                    'uri': '%s/playlists/%s' % (url, playlist_id),
+                    'permalink_url': 'https://soundcloud.com/user%s/sets/%s' % (u, p),
+                    'tracks': [self.tracks[user_id * 10000 + i]
+                               for i in rand.sample(range(tracks_per_user), 10)],
+                }
+        self.playlists[SILVERLINING_PLAYLIST_ID] = {
+            'id': SILVERLINING_PLAYLIST_ID,
+            'kind': 'playlist',
+            'title': 'Silverlining Playlist',
+            'user': {'id': 101, 'username': 'user1'},
+            'user_id': 101,
+            'uri': '%s/playlists/%s' % (url, SILVERLINING_PLAYLIST_ID),
+            'permalink_url': 'https://soundcloud.com/user1/sets/silverlining',
+            'tracks': list(self.tracks.values())[:25],
+        }
+
+    def search(self, items, q):
+        if not q:
+            return list(items)
+        words = q.lower().split()
+        return [i for i in items
+                if all(w in (i.get('title') or i.get('username')).lower() for w in words)]
+
+    def user_tracks(self, user_id):
+        return [t for t in self.tracks.values() if t['user_id'] == user_id]
+
+    def user_playlists(self, user_id):
+        return [p for p in self.playlists.values() if p['user_id'] == user_id]
+
+
+class SoundCloudHandler(FakeHandler):
+    """The endpoints models.py, base.py and auth.py call"""
+    def page(self, items, path):
+        """A collection page if linked_partitioning was asked for, else a list"""
+        limit = int(self.query.get('limit', 50))
+        offset = int(self.query.get('offset', 0))
+        page = items[offset:offset + limit]
+        if not self.query.get('linked_partitioning'):
+            self.send_json(page)
+            return
+        data = {'collection': page}
+        if offset + limit < len(items):
+            query = dict(self.query, offset=offset + limit)
+            data['next_href'] = '%s%s?%s' % (self.server.url, path, urlencode(query))
+        self.send_json(data)
+
+    def activities(self, items, path, wrap):
+        """An activity stream page with next_href/future_href cursors"""
+        limit = int(self.query.get('limit', 50))
+        offset = int(self.query.get('offset', 0))
+        page = items[offset:offset + limit]
+        data = {
+            'collection': [wrap(t) for t in page],
+            'future_href': '%s%s?%s' % (self.server.url, path, urlencode(
+                {'limit': limit, 'uuid[to]': 'latest'})),
+        }
+        if 'uuid[to]' in self.query:
+            # nothing new since the last refresh
+            data['collection'] = []
+        elif offset + limit < len(items):
+            data['next_href'] = '%s%s?%s' % (self.server.url, path, urlencode(
+                {'limit': limit, 'offset': offset + limit}))
+        self.send_json(data)
+
+    def route(self, method, path):
+        cat = self.server.catalogue
+        me = cat.users[101]
+
+        if method == 'POST' and path == '/oauth2/token':
+            self.send_json({'access_token': 'fake-token', 'refresh_token': 'fake-refresh',
+                            'expires_in': 3600, 'scope': '*'})
+        elif method == 'PUT' and re.match(r'^/playlists/\d+$', path):
+            self.send_json(cat.playlists.get(int(path.split('/')[2]), {}))
+        elif method == 'POST' and path == '/playlists':
+            self.send_json(cat.playlists[SILVERLINING_PLAYLIST_ID], 201)
+        elif path == '/me':
+            self.send_json(me)
+        elif path == '/me/playlists':
+            self.page(cat.user_playlists(me['id']) + [cat.playlists[SILVERLINING_PLAYLIST_ID]],
+                      path)
+        elif path == '/me/activities/tracks/affiliated':
+            stream = sorted(cat.tracks.values(), key=lambda t: -t['id'])[:500]
+            self.activities(stream, path, lambda t: {
+                'type': 'track', 'created_at': t['created_at'], 'origin': t})
+        elif path == '/resolve':
+            slug = urlparse(self.query.get('url', '')).path
+            for track in cat.tracks.values():
+                if urlparse(track['permalink_url']).path == slug:
+                    self.send_json(track)
+                    return
+            self.send_json({'error': 'not found'}, 404)
+        elif path == '/users':
+            self.page(cat.search(cat.users.values(), self.query.get('q')), path)
+        elif re.match(r'^/users/\d+$', path):
+            user = cat.users.get(int(path.split('/')[2]))
+            self.send_json(user or {'error': 'not found'}, 200 if user else 404)
+        elif re.match(r'^/users/\d+/tracks$', path):
+            self.page(cat.user_tracks(int(path.split('/')[2])), path)
+        elif re.match(r'^/users/\d+/playlists$', path):
+            self.page(cat.user_playlists(int(path.split('/')[2])), path)
+        elif re.match(r'^/profile/soundcloud:users:\d+$', path):
+            user_id = int(path.rsplit(':', 1)[1])
+            self.activities(cat.user_tracks(user_id), path, lambda t: {
+                'type': 'track', 'created_at': t['created_at'], 'track': t})
+        elif path == '/tracks':
+            if 'ids' in self.query:
+                ids = [int(i) for i in self.query['ids'].split(',') if i]
+                self.send_json([cat.tracks[i] for i in ids if i in cat.tracks])
+            else:
+                self.page(cat.search(cat.tracks.values(), self.query.get('q')), path)
+        elif re.match(r'^/tracks/\d+$', path):
+            track = cat.tracks.get(int(path.split('/')[2]))
+            self.send_json(track or {'error': 'not found'}, 200 if track else 404)
+        elif re.match(r'^/tracks/\d+/related$', path):
+            track_id = int(path.split('/')[2])
+            if track_id not in cat.tracks:
+                self.send_json({'error': 'not found'}, 404)
+                return
+            rand = random.Random(track_id)
+            self.send_json(rand.sample(list(cat.tracks.values()), 20))
+        elif re.match(r'^/tracks/\d+/stream$', path):
+            self.send_redirect('%s/cdn/%s.mp3' % (self.server.url, path.split('/')[2]))
+        elif re.match(r'^/cdn/\d+\.mp3$', path):
+            body = b'\xff\xfb' * 1024
+            self.send_response(200)
+            self.send_header('Content-Type', 'audio/mpeg')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        elif path == '/playlists':
+            self.page(cat.search(cat.playlists.values(), self.query.get('q')), path)
+        elif re.match(r'^/playlists/\d+$', path):
+            playlist = cat.playlists.get(int(path.split('/')[2]))
+            self.send_json(playlist or {'error': 'not found'}, 200 if playlist else 404)
+        else:
+            self.send_json({'error': 'no fake for %s %s' % (method, path)}, 404)
+
+
+class FakeSoundCloud(FakeServer):
+    def __init__(self, latency=0.0, failure_rate=0.0, **catalogue):
+        FakeServer.__init__(self, SoundCloudHandler, latency, failure_rate)
+        self.catalogue = Catalogue(self.url, **catalogue)
+
+
+class VLCHandler(FakeHandler):
+    """requests/status.json and requests/playlist.json"""
+    def route(self, method, path):
+        vlc = self.server
+        with vlc.lock:
+            if path == '/requests/status':
+                vlc.command(self.query)
+                self.send_json(vlc.status())
+            elif path == '/requests/playlist':
+                self.send_json(vlc.playlist())
+            else:
+                self.send_json({'error': 'not found'}, 404)
+
+
+class FakeVLC(FakeServer):
+    """VLC's playlist and playback state, driven by status.json commands"""
+    def __init__(self, latency=0.0, failure_rate=0.0):
+        FakeServer.__init__(self, VLCHandler, latency, failure_rate)
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.items = []
+        self.current = None
+        self.state = 'stopped'
+        self.started_at = 0
+        self._next_id = 4
+
+    def _add(self, uri, name):
+        self.items.append({'id': str(self._next_id), 'name': name, 'uri': uri,
+                           'type': 'leaf', 'duration': 300})
+        self._next_id += 1
+
+    def _find(self, plid):
+        for i, item in enumerate(self.items):
+            if item['id'] == str(plid):
+                return i
+        return None
+
+    def _play(self, i):
+        if i is None or i >= len(self.items):
+            self.current, self.state = None, 'stopped'
+        else:
+            self.current, self.state = self.items[i]['id'], 'playing'
+            self.started_at = time.time()
+
+    def command(self, query):
+        command = query.get('command')
+        current = self._find(self.current)
+        if command == 'in_enqueue':
+            uri = query['input']
+            if uri.startswith('file://') and uri.endswith('.xspf'):
+                ns = {'x': 'http://xspf.org/ns/0/'}
+                root = ET.parse(uri[len('file://'):]).getroot()
+                for track in root.iterfind('.//x:track', ns):
+                    self._add(track.findtext('x:location', '', ns),
+                              track.findtext('x:title', '', ns))
+            else:
+                self._add(uri, query.get('name', uri))
+        elif command == 'pl_play':
+            self._play(self._find(query['id']) if 'id' in query else (current or 0))
+        elif command == 'pl_stop':
+            self.state = 'stopped'
+        elif command == 'pl_pause':
+            self.state = 'paused' if self.state == 'playing' else 'playing'
+        elif command == 'pl_next':
+            self._play(None if current is None else current + 1)
+        elif command == 'pl_delete':
+            i = self._find(query.get('id'))
+            if i is not None:
+                del self.items[i]
+                if i == current:
+                    self._play(i)
+        elif command == 'pl_sort' and query.get('val') == 'random':
+            random.shuffle(self.items)
+        elif command == 'pl_empty':
+            self.items = []
+            self._play(None)
+
+    def status(self):
+        status = {'state': self.state, 'length': 0, 'time': 0, 'information': {}}
+        i = self._find(self.current)
+        if i is not None:
+            status['length'] = self.items[i]['duration']
+            status['time'] = int(time.time() - self.started_at) % self.items[i]['duration']
+            status['information'] = {'category': {'meta': {'title': self.items[i]['name']}}}
+        return status
+
+    def playlist(self):
+        return {'name': '', 'children': [
+            {'id': '1', 'name': 'Playlist', 'children': list(self.items)},
+            {'id': '2', 'name': 'Media Library', 'children': []},
+        ]}
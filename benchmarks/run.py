@@ -0,0 +1,286 @@
+"""End-to-end benchmarks against local SoundCloud and VLC stand-ins
+
+    python benchmarks/run.py [--runs 5] [--api-latency 0.05] [--output results.json]
+
+Each benchmark is run --runs times against the fakes in benchmarks/fakes.py
+with a throwaway HOME, so nothing is read from or written to the real
+~/.silverlining. Results are printed, and written as json with --output.
+Medians above the ceilings in benchmarks/thresholds.json, or more than
+--tolerance slower than a --baseline results file, are regressions and
+make the run exit with status 1.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from fakes import FakeSoundCloud, FakeVLC
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+THRESHOLDS_FILE = os.path.join(ROOT, 'benchmarks', 'thresholds.json')
+
+
+def write_config(home, api, vlc):
+    dot_files = os.path.join(home, '.silverlining')
+    os.makedirs(dot_files)
+    with open(os.path.join(dot_files, 'config.json'), 'w') as f:
+        json.dump({
+            'client_id': 'fake-client-id',
+            'secret_key': 'fake-secret',
+            'username': 'user1',
+            'password': 'fake-password',
+            'api_url': api.url,
+            'api_v2_url': api.url,
+            'vlc_url': vlc.url + '/requests/',
+            # stands in for the VLC process, the fake is already listening
+            'vlc_command': [sys.executable, '-c', 'import time; time.sleep(3600)'],
+        }, f, indent=2)
+
+
+def measure(func, runs, setup=None):
+    """Times func over runs, setup() runs untimed before each"""
+    times, errors = [], []
+    for _ in range(runs):
+        if setup:
+            setup()
+        start = time.time()
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                func()
+        except Exception as e:
+            errors.append('%s: %s' % (type(e).__name__, e))
+            continue
+        times.append(time.time() - start)
+
+    times.sort()
+    return {
+        'runs': runs,
+        'median': times[len(times) // 2] if times else None,
+        'min': times[0] if times else None,
+        'max': times[-1] if times else None,
+        'errors': errors,
+    }
+
+
+class Benchmarks(object):
+    def __init__(self, home, api, vlc, runs):
+        self.home = home
+        self.api = api
+        self.vlc = vlc
+        self.runs = runs
+
+        # silverlining reads its config from HOME when it's imported
+        os.environ['HOME'] = home
+        sys.path.insert(0, ROOT)
+        import silverlining
+        from silverlining import cache, vlc as player
+        self.silverlining = silverlining
+        self.cache = cache
+        self.Player = player.Player
+
+    def clear_cache(self):
+        shutil.rmtree(self.cache.response_cache.path, ignore_errors=True)
+        self.cache.response_cache._size = None
+
+    def reset(self):
+        self.clear_cache()
+        self.vlc.reset()
+
+    def tracks(self, n):
+        Track = self.silverlining.Track
+        return [Track(t) for t in list(self.api.catalogue.tracks.values())[:n]]
+
+    def cold_start(self):
+        """A fresh process running a search, from import through dispatch"""
+        env = dict(os.environ, HOME=self.home, PYTHONPATH=ROOT)
+        cmd = [sys.executable, '-c',
+               "import silverlining; silverlining.cli(['s', 't', 'patience'])"]
+        return measure(
+            lambda: subprocess.check_call(cmd, env=env, stdout=subprocess.DEVNULL),
+            self.runs, self.reset)
+
+    def cli_search(self):
+        return measure(lambda: self.silverlining.cli_search(None, 'track', 'patience'),
+                       self.runs, self.reset)
+
+    def cli_play(self):
+        # time it takes to get to playback, not the playback itself
+        run, self.Player.run = self.Player.run, lambda player: None
+        try:
+            return measure(lambda: self.silverlining.cli_play(None, 'track', 'patience'),
+                           self.runs, self.reset)
+        finally:
+            self.Player.run = run
+
+    def load_tracks(self, n):
+        tracks = self.tracks(n)
+
+        def load():
+            with self.Player(no_input=True) as player:
+                start = time.time()
+                failed = player.load_tracks(tracks)
+                elapsed = time.time() - start
+            if failed:
+                raise Exception('%s tracks failed to load' % len(failed))
+            return elapsed
+
+        return self._timed_inside(load)
+
+    def remove_track(self, n=1000, removed=100):
+        """Time to remove removed tracks, one by one, from a queue of n"""
+        tracks = self.tracks(n)
+
+        def remove():
+            with self.Player(no_input=True) as player:
+                player.load_tracks(tracks)
+                middle = player.queue[n // 2:n // 2 + removed]
+                start = time.time()
+                for track in middle:
+                    player.remove_track(track)
+                return time.time() - start
+
+        return self._timed_inside(remove)
+
+    def shuffle(self, n=1000):
+        tracks = self.tracks(n)
+
+        def shuffle():
+            with self.Player(no_input=True) as player:
+                player.load_tracks(tracks)
+                start = time.time()
+                player.shuffle()
+                return time.time() - start
+
+        return self._timed_inside(shuffle)
+
+    def _timed_inside(self, func):
+        """Like measure, for funcs that time their own critical section"""
+        elapsed = []
+
+        def run():
+            elapsed.append(func())
+
+        result = measure(run, self.runs, self.reset)
+        elapsed.sort()
+        if elapsed:
+            result.update(median=elapsed[len(elapsed) // 2],
+                          min=elapsed[0], max=elapsed[-1])
+        return result
+
+    def run(self, only=None):
+        benchmarks = [
+            ('cold_start', self.cold_start),
+            ('cli_search', self.cli_search),
+            ('cli_play', self.cli_play),
+            ('load_tracks_10', lambda: self.load_tracks(10)),
+            ('load_tracks_100', lambda: self.load_tracks(100)),
+            ('load_tracks_1000', lambda: self.load_tracks(1000)),
+            ('remove_track_1000', self.remove_track),
+            ('shuffle_1000', self.shuffle),
+        ]
+        results = {}
+        for name, func in benchmarks:
+            if only and name not in only:
+                continue
+            results[name] = func()
+            sys.stderr.write('%-20s %s\n' % (name, format_result(results[name])))
+        return results
+
+
+def format_result(result):
+    if result['median'] is None:
+        return 'failed: %s' % (result['errors'][0] if result['errors'] else '?')
+    line = 'median %.4fs  min %.4fs  max %.4fs' % (
+        result['median'], result['min'], result['max'])
+    if result['errors']:
+        line += '  %s errors' % len(result['errors'])
+    return line
+
+
+def regressions(results, thresholds, baseline=None, tolerance=0.25):
+    found = []
+    for name, result in sorted(results.items()):
+        median = result['median']
+        if median is None:
+            found.append('%s failed every run' % name)
+            continue
+        if name in thresholds and median > thresholds[name]:
+            found.append('%s median %.4fs is over its %.4fs ceiling' % (
+                name, median, thresholds[name]))
+        before = (baseline or {}).get(name, {}).get('median')
+        if before and median > before * (1 + tolerance):
+            found.append('%s median %.4fs is %d%% slower than the baseline %.4fs' % (
+                name, median, 100 * (median / before - 1), before))
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--api-latency', type=float, default=0.0,
+                        help='seconds added to every fake SoundCloud request')
+    parser.add_argument('--vlc-latency', type=float, default=0.0,
+                        help='seconds added to every fake VLC request')
+    parser.add_argument('--api-failure-rate', type=float, default=0.0,
+                        help='fraction of fake SoundCloud requests answered with a 503')
+    parser.add_argument('--vlc-failure-rate', type=float, default=0.0,
+                        help='fraction of fake VLC requests answered with a 503')
+    parser.add_argument('--only', nargs='*', help='names of the benchmarks to run')
+    parser.add_argument('--output', help='file to write the json results to')
+    parser.add_argument('--thresholds', default=THRESHOLDS_FILE)
+    parser.add_argument('--baseline', help='results file to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='how much slower than the baseline is a regression')
+    args = parser.parse_args()
+
+    api = FakeSoundCloud(args.api_latency, args.api_failure_rate).start()
+    vlc = FakeVLC(args.vlc_latency, args.vlc_failure_rate).start()
+    home = tempfile.mkdtemp(prefix='silverlining-bench-')
+    try:
+        write_config(home, api, vlc)
+        results = Benchmarks(home, api, vlc, args.runs).run(args.only)
+    finally:
+        api.stop()
+        vlc.stop()
+        shutil.rmtree(home, ignore_errors=True)
+
+    with open(args.thresholds) as f:
+        thresholds = json.load(f)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+    found = regressions(results, thresholds, baseline, args.tolerance)
+
+    output = {
+        'settings': {
+            'runs': args.runs,
+            'api_latency': args.api_latency,
+            'vlc_latency': args.vlc_latency,
+            'api_failure_rate': args.api_failure_rate,
+            'vlc_failure_rate': args.vlc_failure_rate,
+        },
+        'results': results,
+        'regressions': found,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(output, f, indent=2)
+    else:
+        json.dump(output, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+
+    for regression in found:
+        sys.stderr.write('REGRESSION: %s\n' % regression)
+    sys.exit(1 if found else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -4,8 +4,8 @@ setup(
     name='silverlining',
     version='0.1',
     packages=['silverlining'],
+    python_requires='>=3.7',
     install_requires=[
-        'click',
         'soundcloud',
         'requests',
         'fuzzywuzzy',
@@ -5,131 +5,212 @@ __license__ = 'MIT'
 __copyright__ = 'Copyright 2014 ' + __author__
 
 import atexit
+import importlib
 import os
-import simplejson
 import sys
+import threading
 
-# Get settings
+from silverlining.timings import timings
+
+# Dotfiles
 DOT_FILES = os.path.expanduser('~/.silverlining')
 CONFIG_FILE = os.path.expanduser('~/.silverlining/config.json')
-HIST_FILE = os.path.expanduser('~/.silverlining/history.json')
-
-try:
-    with open(CONFIG_FILE, 'rb') as f:
-        config = f.read()
-        config = simplejson.loads(config)
-
-        CLIENT_ID = config['client_id']
-        SECRET_KEY = config['secret_key']
-        USERNAME = config['username']
-        PASSWORD = config['password']
-
-except Exception as e:
-    if not os.path.isdir(DOT_FILES):
-        os.mkdir(DOT_FILES)
-
-    if not os.path.isfile(CONFIG_FILE):
-        with open(CONFIG_FILE, 'w') as f:
-            f.write(simplejson.dumps(
-                {'client_id': '', 'secret_key': '', 'username': '', 'password': ''},
-                indent=2,
-            ))
-
-    sys.stdout.write(
-        "Need to enter your api and login credentials for SoundCloud.\n"
-        "Please edit %s.\n\n" % CONFIG_FILE +
-        "If you need to sign up for an API key, please visit "
-        "http://soundcloud.com/you/apps and create an app.\n"
-    )
-    sys.exit(1)
-
-import click
-import soundcloud
-
+HIST_FILE = os.path.expanduser('~/.silverlining/history.jsonl')
+LEGACY_HIST_FILE = os.path.expanduser('~/.silverlining/history.json')
+PLAYLIST_FILE = os.path.expanduser('~/.silverlining/playlist.json')
+STREAMS_DIR = os.path.expanduser('~/.silverlining/streams')
+TOKEN_FILE = os.path.expanduser('~/.silverlining/token.json')
+CACHE_DIR = os.path.expanduser('~/.silverlining/cache')
+AUDIO_DIR = os.path.expanduser('~/.silverlining/audio')
+STATS_FILE = os.path.expanduser('~/.silverlining/stats.json')
+SOCKET_FILE = os.path.expanduser('~/.silverlining/daemon.sock')
+CATALOGUE_FILE = os.path.expanduser('~/.silverlining/catalogue.db')
+
+
+class LoginError(Exception):
+    """Logging in to SoundCloud failed
+
+    Login happens on first use, often on a worker thread, so it's up to
+    whoever started the command to report it.
+    """
+    def __init__(self, msg="Unable to connect to SoundCloud. "
+                           "Check your config.json or network connection."):
+        super(LoginError, self).__init__(msg)
+
+
+# Settings from config.json, the API client and the heavier parts of the
+# package are only loaded when something first asks for them (see
+# __getattr__ below), so cheap commands don't pay for what they don't use.
+LAZY = {
+    'Player': 'silverlining.vlc',
+    'Playlist': 'silverlining.models',
+    'PlaylistNotFoundError': 'silverlining.models',
+    'Track': 'silverlining.models',
+    'TrackNotFoundError': 'silverlining.models',
+    'User': 'silverlining.models',
+    'UserNotFoundError': 'silverlining.models',
+    'get_play_tracks': 'silverlining.base',
+    'get_search_results': 'silverlining.base',
+    'get_search_interp': 'silverlining.grammar',
+    'parse_search_arguments': 'silverlining.grammar',
+}
+_lazy_lock = threading.RLock()
+
+
+def __getattr__(name):
+    with _lazy_lock:
+        if name in globals():
+            return globals()[name]
+        if name.isupper() and name in importlib.import_module('silverlining.config').NAMES:
+            with timings.phase('config'):
+                globals().update(importlib.import_module('silverlining.config').load())
+        elif name == 'client':
+            # SoundCloud login is deferred until the first API call
+            with timings.phase('import auth'):
+                from silverlining.auth import LazyClient
+            globals()['client'] = LazyClient()
+        elif name in LAZY:
+            with timings.phase('import ' + LAZY[name]):
+                module = importlib.import_module(LAZY[name])
+            globals()[name] = getattr(module, name)
+        else:
+            raise AttributeError("module 'silverlining' has no attribute %r" % name)
+        return globals()[name]
+
+
+USAGE = """usage: silverlining [--timings] [command] [args...]
+
+commands: s/search, p/play, r/radio, sync, headless, and with headless
+running e/enqueue, status, l/list, n/next, pause, stop
+
+--timings reports how long startup and each phase took
+See the README for the search grammar.
+"""
+COMMANDS = ['s', 'search', 'p', 'play', 'r', 'radio', 'sync', 'headless']
+# what each command imports to run, search's modules when it isn't listed
+COMMAND_MODULES = {
+    'search': ['silverlining.base'],
+    'p': ['silverlining.base', 'silverlining.vlc'],
+    'play': ['silverlining.base', 'silverlining.vlc'],
+    'r': ['silverlining.base', 'silverlining.vlc'],
+    'radio': ['silverlining.base', 'silverlining.vlc'],
+    'sync': ['silverlining.catalogue'],
+    'headless': ['silverlining.daemon'],
+}
+
+
+def cli(argv=None):
+    """Main entry point of the script
+
+    Commands are handed to the daemon started by `silverlining headless`
+    when there's one running, and run in this process otherwise.
+    """
+    argv = sys.argv[1:] if argv is None else list(argv)
+    if '--timings' in argv:
+        argv.remove('--timings')
+        timings.enabled = True
+        atexit.register(timings.report)
+    if argv and argv[0] in ['-h', '--help', 'help']:
+        sys.stdout.write(USAGE)
+        return
+    cmd, args = (argv[0] if argv else None), argv[1:]
 
-# Try to connect to SoundCloud API
-try:
-    client = soundcloud.Client(
-        client_id=CLIENT_ID,
-        client_secret=SECRET_KEY,
-        username=USERNAME,
-        password=PASSWORD,
-    )
-except Exception as e:
-    sys.stdout.write(
-        "Unable to connect to SoundCloud. Check your config.json or network connection.\n"
-    )
-    sys.exit(1)
-
-
-from silverlining.base import (
-    parse_search_arguments,
-    get_search_results,
-    get_search_interp,
-)
-from silverlining.models import (
-    Playlist,
-    Track,
-    User,
-)
-from silverlining.vlc import (
-    Player,
-)
-
-
-@click.command()
-@click.argument('cmd', nargs=1, required=False)
-@click.argument('args', nargs=-1, required=False)
-def cli(cmd=None, args=None):
-    """Main entry point of the script"""
-    if cmd == 'headless':
-        with Player(no_input=True) as player:
-            player.run()
+    from silverlining import control
+    if cmd != 'headless':
+        with timings.phase('daemon'):
+            sent = control.send(cmd, args)
+        if sent:
             return
+    if cmd in control.DAEMON_COMMANDS:
+        sys.stdout.write("%s needs silverlining headless to be running\n" % cmd)
+        return
+    if cmd and cmd not in COMMANDS:
+        sys.stdout.write("Unrecognized command %s\n" % cmd)
+        return
 
+    from silverlining.grammar import parse_search_arguments
     try:
-        username, category, query = parse_search_arguments(args)
+        with timings.phase('parse'):
+            username, category, query = (
+                (None, None, None) if cmd in ['sync', 'headless'] else
+                parse_search_arguments(args))
     except Exception as e:
         sys.stdout.write("%s\n" % e)
         return
 
-    if cmd in ['s', 'search'] or not cmd:
-        cli_search(username, category, query)
-    elif cmd in ['p', 'play']:
-        cli_play(username, category, query)
-    else:
-        sys.stdout.write("Unrecognized command %s\n" % cmd)
+    with timings.phase('import stats'):
+        from silverlining.stats import stats
+    stats.install()
+    # the command's modules are most of the startup cost, import them
+    # before startup is over so they count against the budget
+    for module in COMMAND_MODULES.get(cmd, COMMAND_MODULES['search']):
+        with timings.phase('import ' + module):
+            importlib.import_module(module)
+    timings.ready()
+
+    try:
+        if cmd == 'headless':
+            from silverlining.daemon import Daemon
+            Daemon().serve()
+        elif cmd == 'sync':
+            from silverlining.catalogue import catalogue
+            catalogue.sync(full='full' in args)
+        elif cmd in ['s', 'search'] or not cmd:
+            cli_search(username, category, query)
+        elif cmd in ['p', 'play']:
+            cli_play(username, category, query)
+        elif cmd in ['r', 'radio']:
+            cli_play(username, category, query, radio=True)
+    except LoginError as e:
+        sys.stdout.write("%s\n" % e)
+        sys.exit(1)
 
     sys.stdout.write("\n")
 
 
 def cli_search(username, category, query):
+    import requests
+    from silverlining.base import get_search_interp, get_search_results
+
     sys.stdout.write("Searching " + get_search_interp(username, category, query) + "\n")
-    items = get_search_results(username, category, query)
+    try:
+        with timings.phase('search'):
+            items = get_search_results(username, category, query)
+    except requests.exceptions.RequestException as e:
+        sys.stdout.write("SoundCloud request failed: %s" % e)
+        return
     sys.stdout.write(u"\n".join([i.cli_display for i in items]))
 
 
-def cli_play(username, category, query):
+def cli_play(username, category, query, radio=False):
+    import requests
+    from silverlining.base import get_play_tracks, get_search_interp, get_search_results
+    from silverlining.models import (
+        PlaylistNotFoundError,
+        TrackNotFoundError,
+        UserNotFoundError,
+    )
+    from silverlining.vlc import Player
+
     sys.stdout.write("Playing " +
                      get_search_interp(username, category, query, 'play') +
                      "\n")
     try:
-        items = get_search_results(username, category, query)
-    except (models.UserNotFoundError, models.TrackNotFoundError, models.PlaylistNotFoundError) as e:
+        with timings.phase('search'):
+            items = get_search_results(username, category, query)
+    except (UserNotFoundError, TrackNotFoundError, PlaylistNotFoundError) as e:
         sys.stdout.write(e.args[0])
         return
+    except requests.exceptions.RequestException as e:
+        sys.stdout.write("SoundCloud request failed: %s" % e)
+        return
 
-    if not len(items):
+    tracks = get_play_tracks(items, category)
+    if not tracks:
         sys.stdout.write("Nothing found. Exiting.")
         return
 
-    if category == 'user':
-        tracks = items[0].stream
-    elif items[0]['kind'] == 'track':
-        tracks = items
-    else:
-        tracks = items[0].tracks
-
-    with Player() as player:
-        player.load_tracks(tracks)
+    with Player(radio=radio) as player:
+        with timings.phase('load tracks'):
+            player.load_tracks(tracks)
         player.run()
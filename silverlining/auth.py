@@ -0,0 +1,163 @@
+import functools
+import os
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+import simplejson
+import soundcloud
+
+from silverlining import (
+    API_URL,
+    CLIENT_ID,
+    LoginError,
+    SECRET_KEY,
+    USERNAME,
+    PASSWORD,
+    TOKEN_FILE,
+)
+from silverlining.transport import transport
+
+
+# refresh access tokens this many seconds before they actually expire
+EXPIRY_MARGIN = 60
+
+
+def load_token():
+    """Returns the cached token for the configured user or None"""
+    try:
+        with open(TOKEN_FILE, 'rb') as f:
+            token = simplejson.loads(f.read())
+    except (IOError, ValueError):
+        return None
+
+    if token.get('username') != USERNAME or not token.get('access_token'):
+        return None
+    return token
+
+
+def save_token(token):
+    """Writes the token to disk, readable only by the current user"""
+    fd = os.open(TOKEN_FILE, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w') as f:
+        f.write(simplejson.dumps(token, indent=2))
+
+
+def client_options():
+    """Where soundcloud.Client should send requests, from API_URL"""
+    url = urlparse(API_URL)
+    return {'host': url.netloc, 'use_ssl': url.scheme == 'https'}
+
+
+def token_expired(token):
+    expires_at = token.get('expires_at')
+    return expires_at is not None and time.time() > expires_at - EXPIRY_MARGIN
+
+
+class LazyClient(object):
+    """Stand-in for soundcloud.Client that only logs in when first used
+
+    The access token is cached in TOKEN_FILE and reused across invocations
+    until it expires, at which point it's refreshed with the refresh token,
+    falling back to a full password login if that fails. Requests rejected
+    with a 401 are retried once with a fresh token.
+
+    soundcloud.Client is only used to log in. Its own requests open a new
+    connection every time, so API calls go through the transport instead
+    and come back wrapped in soundcloud resources just the same.
+    """
+    _methods = ('get', 'post', 'put', 'delete', 'head')
+
+    def __init__(self):
+        self._client = None
+        self._token = None
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        if name in self._methods:
+            return functools.partial(self._request, name)
+        return getattr(self.connect(), name)
+
+    def _request(self, method, endpoint, **kwargs):
+        resp = self.response(method, endpoint, kwargs)
+        resp.raise_for_status()
+        return soundcloud.resource.wrapped_resource(resp)
+
+    def response(self, method, endpoint, params=None, headers=None):
+        """The raw response, for callers that need its status or headers"""
+        resp = self._send(self.connect(), method, endpoint, params, headers)
+        if resp.status_code == 401:
+            resp = self._send(self.connect(force=True), method, endpoint, params, headers)
+        return resp
+
+    def _send(self, client, method, endpoint, params, headers):
+        url = endpoint if endpoint.startswith('http') else API_URL + '/' + endpoint.lstrip('/')
+        headers = dict(headers or {})
+        headers.update({
+            'Accept': 'application/json',
+            'Authorization': 'OAuth %s' % client.access_token,
+        })
+        if method == 'get':
+            return transport.get(url, params=params, headers=headers)
+        return transport.request(method, url, json=params or None, headers=headers)
+
+    def connect(self, force=False):
+        """Returns a logged in soundcloud.Client"""
+        with self._lock:
+            if force or self._client is None or token_expired(self._token):
+                self._login(force)
+            return self._client
+
+    def _login(self, force=False):
+        token = self._token or load_token()
+        if token and not force and not token_expired(token):
+            self._token = token
+            self._client = soundcloud.Client(
+                client_id=CLIENT_ID,
+                access_token=token['access_token'],
+                **client_options()
+            )
+            return
+
+        client = None
+        if token and token.get('refresh_token'):
+            try:
+                client = soundcloud.Client(
+                    client_id=CLIENT_ID,
+                    client_secret=SECRET_KEY,
+                    refresh_token=token['refresh_token'],
+                    **client_options()
+                )
+            except requests.exceptions.RequestException:
+                client = None
+
+        if client is None:
+            try:
+                client = soundcloud.Client(
+                    client_id=CLIENT_ID,
+                    client_secret=SECRET_KEY,
+                    username=USERNAME,
+                    password=PASSWORD,
+                    **client_options()
+                )
+            except Exception:
+                raise LoginError()
+
+        self._client = client
+        self._token = self._token_from(client)
+        try:
+            save_token(self._token)
+        except (IOError, OSError):
+            pass
+
+    def _token_from(self, client):
+        obj = client.token.obj
+        expires_in = obj.get('expires_in')
+        return {
+            'username': USERNAME,
+            'access_token': client.access_token,
+            'refresh_token': obj.get('refresh_token'),
+            'scope': obj.get('scope'),
+            'expires_at': time.time() + expires_in if expires_in else None,
+        }
@@ -1,65 +1,55 @@
-import requests
+from concurrent.futures import (
+    ThreadPoolExecutor,
+    as_completed,
+)
 
 from silverlining import (
+    API_URL,
     CLIENT_ID,
     models,
     utils,
 )
+from silverlining.cache import cached_get
+from silverlining.catalogue import catalogue
+from silverlining.grammar import (
+    get_search_interp,
+    parse_search_arguments,
+)
 from silverlining.models import get_silverlining_playlist
 
 
-def parse_search_arguments(args):
-    if not args or args[0] == '':
-        return None, 'sllist', None
-    if args[0].startswith('http'):
-        # it's a url
-        resp = requests.get("https://api.soundcloud.com/resolve.json",
-                            params={'url': args[0], 'client_id': CLIENT_ID})
-        data = resp.json()
-        return None, data['kind'], data['id']
-    elif len(args) == 1 and utils.isint(args[0]):
-        # it's an id, try it as a track and then as a playlist
-        try:
-            track = models.Track.get_one(args[0])
-            return None, 'track', args[0]
-        except models.TrackNotFoundError:
-            pass
-        try:
-            playlist = models.Playlist.get_one(args[0])
-            return None, 'playlist', args[0]
-        except models.PlaylistNotFoundError:
-            raise Exception("Unable to find item with id %s" % args[0])
-    elif args[0] in ['me', 'stream']:
-        if len(args) > 1:
-            return 'me', 'stream', args[1]
-        return 'me', 'stream', None
-    elif args[0] in ['t', 'track', 'tracks']:
-        if len(args) > 1:
-            return None, 'track', args[1]
-        raise Exception("not enough arguments")
-    elif args[0] in ['p', 'playlist', 'playlists']:
-        if len(args) > 1:
-            return None, 'playlist', args[1]
-        raise Exception("not enough arguments")
-    else:
-        if len(args) == 1:
-            return args[0], 'user', None
-        elif args[1] in ['t', 'track', 'tracks']:
-            if len(args) > 2:
-                return args[0], 'track', args[2]
-            return args[0], 'track', None
-        elif args[1] in ['p', 'playlist', 'playlists']:
-            if len(args) > 2:
-                return args[0], 'playlist', args[2]
-            return args[0], 'playlist', None
-        elif args[1] in ['s', 'stream']:
-            if len(args) > 2:
-                return args[0], 'stream', args[2]
-            return args[0], 'stream', None
-    raise Exception("unable to parse command %s" % ' '.join(args))
+def resolve_url(url):
+    """Returns the kind and id of the item at a soundcloud.com url"""
+    data = cached_get(API_URL + "/resolve.json",
+                      params={'url': url, 'client_id': CLIENT_ID})
+    return data['kind'], data['id']
+
+
+def resolve_id(item_id):
+    """Probes for a track and a playlist with the id at once, first hit wins"""
+    probes = {
+        models.Track.get_by_id: 'track',
+        models.Playlist.get_by_id: 'playlist',
+    }
+    pool = ThreadPoolExecutor(len(probes))
+    try:
+        futures = {pool.submit(probe, item_id): kind for probe, kind in probes.items()}
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except (models.TrackNotFoundError, models.PlaylistNotFoundError):
+                continue
+            return futures[future]
+    finally:
+        pool.shutdown(wait=False)
+    raise Exception("Unable to find item with id %s" % item_id)
 
 
 def get_search_results(username, category, query):
+    items = catalogue.search(username, category, query)
+    if items:
+        return items
+
     if category == 'sllist':
         items = get_silverlining_playlist().tracks
         if query:
@@ -84,28 +74,12 @@ def get_search_results(username, category, query):
     return items
 
 
-def get_search_interp(username, category, query, action='search'):
-    interp = ""
-    if category == 'sllist':
-        interp += "silverlining playlist"
-    elif category == 'stream':
-        if username == 'me':
-            interp += "your stream"
-        else:
-            interp = "%s's stream" % username
-    elif username:
-        if category == 'user':
-            if action == 'search':
-                interp += "users matching %s" % username
-            else:
-                interp += "%s's stream" % username
-        else:
-            interp += "%s's %ss" % (username, category)
-    else:
-        if query and utils.isint(query):
-            interp += "%s id %s" % (category, query)
-        else:
-            interp += "%ss" % category
-    if query and not utils.isint(query):
-        interp += " for %s" % query
-    return interp
+def get_play_tracks(items, category):
+    """Tracks to play for a search's results"""
+    if not items:
+        return []
+    if category == 'user':
+        return items[0].stream
+    elif items[0]['kind'] == 'track':
+        return items
+    return items[0].tracks
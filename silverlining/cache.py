@@ -0,0 +1,177 @@
+import hashlib
+import os
+import re
+import tempfile
+import threading
+import time
+
+import simplejson
+
+from silverlining import (
+    CACHE_DIR,
+    CACHE_MAX_BYTES,
+    USERNAME,
+)
+from silverlining.transport import transport
+
+
+MINUTE = 60
+HOUR = 60 * MINUTE
+DAY = 24 * HOUR
+WEEK = 7 * DAY
+
+# Time to live by resource, first matching pattern wins. Track and playlist
+# metadata by id rarely changes; searches and streams do.
+TTLS = [
+    (re.compile(r'/(tracks|playlists)/\d+(\.json)?$'), WEEK),
+    (re.compile(r'/tracks/\d+/related'), DAY),
+    (re.compile(r'/users/\d+(\.json)?$'), DAY),
+    (re.compile(r'/resolve'), DAY),
+    (re.compile(r'/users/\d+/(tracks|playlists)'), HOUR),
+    (re.compile(r'(^/?me/|/profile/|/activities)'), MINUTE),
+]
+DEFAULT_TTL = 5 * MINUTE
+# how long to remember that a resource 404'd
+NEGATIVE_TTL = DAY
+
+
+def ttl_for(endpoint):
+    path = endpoint.split('?', 1)[0]
+    for pattern, ttl in TTLS:
+        if pattern.search(path):
+            return ttl
+    return DEFAULT_TTL
+
+
+class ResponseCache(object):
+    """On-disk cache of API responses keyed by endpoint and params
+
+    Each response is stored as its own json file. A file's mtime is bumped
+    whenever it's read so that once the cache grows past max_bytes the least
+    recently used entries can be evicted first. Expired entries are kept
+    around so they can be revalidated with a conditional request.
+    """
+    def __init__(self, path=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._size = None
+        self._lock = threading.Lock()
+
+    def _key(self, endpoint, params):
+        key = simplejson.dumps([USERNAME, endpoint, params or {}], sort_keys=True)
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+    def _filename(self, key):
+        return os.path.join(self.path, key + '.json')
+
+    def lookup(self, endpoint, params=None):
+        """Returns the cached entry, fresh or not, or None"""
+        filename = self._filename(self._key(endpoint, params))
+        try:
+            with open(filename, 'rb') as f:
+                entry = simplejson.loads(f.read())
+            os.utime(filename, None)
+        except (IOError, OSError, ValueError):
+            return None
+        entry['fresh'] = time.time() < entry['stored'] + entry['ttl']
+        return entry
+
+    def store(self, endpoint, params, data, etag=None, last_modified=None, ttl=None):
+        entry = {
+            'endpoint': endpoint,
+            'params': params or {},
+            'stored': time.time(),
+            'ttl': ttl_for(endpoint) if ttl is None else ttl,
+            'etag': etag,
+            'last_modified': last_modified,
+            'data': data,
+        }
+        self._write(self._key(endpoint, params), entry)
+
+    def revalidated(self, entry):
+        """Marks an entry as fresh again after a 304"""
+        entry.pop('fresh', None)
+        entry['stored'] = time.time()
+        self._write(self._key(entry['endpoint'], entry['params']), entry)
+
+    def _write(self, key, entry):
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+
+        data = simplejson.dumps(entry).encode('utf-8')
+        fd, tmp = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.rename(tmp, self._filename(key))
+
+        with self._lock:
+            if self._size is None:
+                self._size = self._disk_usage()
+            else:
+                self._size += len(data)
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _entries(self):
+        for name in os.listdir(self.path):
+            if not name.endswith('.json'):
+                continue
+            try:
+                st = os.stat(os.path.join(self.path, name))
+            except OSError:
+                continue
+            yield st.st_mtime, st.st_size, name
+
+    def _disk_usage(self):
+        return sum(size for _, size, _ in self._entries())
+
+    def _evict(self):
+        """Removes least recently used entries until under 90% of max_bytes"""
+        entries = sorted(self._entries())
+        size = sum(size for _, size, _ in entries)
+        target = self.max_bytes * 0.9
+        for _, entry_size, name in entries:
+            if size <= target:
+                break
+            try:
+                os.remove(os.path.join(self.path, name))
+            except OSError:
+                continue
+            size -= entry_size
+        self._size = size
+
+
+response_cache = ResponseCache()
+
+
+def cached_get(url, params=None, get=None):
+    """transport.get(url).json() through the response cache
+
+    Stale entries are revalidated with If-None-Match/If-Modified-Since when
+    the server handed out an ETag or Last-Modified header. get(headers)
+    makes the request instead of transport.get when given.
+    """
+    entry = response_cache.lookup(url, params)
+    if entry and entry['fresh']:
+        return entry['data']
+
+    headers = {}
+    if entry and entry.get('etag'):
+        headers['If-None-Match'] = entry['etag']
+    if entry and entry.get('last_modified'):
+        headers['If-Modified-Since'] = entry['last_modified']
+
+    if get is None:
+        resp = transport.get(url, params=params, headers=headers)
+    else:
+        resp = get(headers)
+    if resp.status_code == 304 and entry:
+        response_cache.revalidated(entry)
+        return entry['data']
+    resp.raise_for_status()
+
+    data = resp.json()
+    response_cache.store(url, params, data,
+                         etag=resp.headers.get('ETag'),
+                         last_modified=resp.headers.get('Last-Modified'))
+    return data
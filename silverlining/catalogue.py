@@ -0,0 +1,308 @@
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+
+import requests
+
+from silverlining import (
+    CATALOGUE_FILE,
+    RESULTS_LIMIT,
+    USERNAME,
+    client,
+    utils,
+)
+from silverlining.cache import response_cache
+from silverlining.history import History
+from silverlining.models import (
+    Playlist,
+    Track,
+    User,
+    soundcloud_pages,
+)
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tracks (
+    id INTEGER PRIMARY KEY,
+    title TEXT,
+    username TEXT,
+    stream_url TEXT,
+    permalink_url TEXT,
+    duration INTEGER,
+    tag_list TEXT
+);
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY,
+    username TEXT,
+    full_name TEXT,
+    permalink_url TEXT
+);
+CREATE TABLE IF NOT EXISTS playlists (
+    id INTEGER PRIMARY KEY,
+    user_id INTEGER,
+    title TEXT,
+    username TEXT,
+    uri TEXT,
+    permalink_url TEXT
+);
+-- which tracks are in a user's uploads, a playlist, likes or history
+CREATE TABLE IF NOT EXISTS collection_tracks (
+    collection TEXT,
+    track_id INTEGER,
+    position INTEGER,
+    PRIMARY KEY (collection, track_id)
+);
+CREATE INDEX IF NOT EXISTS collection_tracks_position
+    ON collection_tracks (collection, position);
+-- high-water mark per collection, the newest item seen by the last sync
+CREATE TABLE IF NOT EXISTS marks (
+    collection TEXT PRIMARY KEY,
+    mark TEXT,
+    synced_at REAL
+);
+"""
+
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS tracks_fts USING fts5(
+    title, username, tag_list, content='tracks', content_rowid='id');
+CREATE TRIGGER IF NOT EXISTS tracks_ai AFTER INSERT ON tracks BEGIN
+    INSERT INTO tracks_fts (rowid, title, username, tag_list)
+    VALUES (new.id, new.title, new.username, new.tag_list);
+END;
+CREATE TRIGGER IF NOT EXISTS tracks_ad AFTER DELETE ON tracks BEGIN
+    INSERT INTO tracks_fts (tracks_fts, rowid, title, username, tag_list)
+    VALUES ('delete', old.id, old.title, old.username, old.tag_list);
+END;
+CREATE TRIGGER IF NOT EXISTS tracks_au AFTER UPDATE ON tracks BEGIN
+    INSERT INTO tracks_fts (tracks_fts, rowid, title, username, tag_list)
+    VALUES ('delete', old.id, old.title, old.username, old.tag_list);
+    INSERT INTO tracks_fts (rowid, title, username, tag_list)
+    VALUES (new.id, new.title, new.username, new.tag_list);
+END;
+"""
+
+UPSERT_TRACK = """
+INSERT INTO tracks (id, title, username, stream_url, permalink_url, duration, tag_list)
+VALUES (:id, :title, :username, :stream_url, :permalink_url, :duration, :tag_list)
+ON CONFLICT (id) DO UPDATE SET
+    title = excluded.title,
+    username = excluded.username,
+    stream_url = excluded.stream_url,
+    permalink_url = excluded.permalink_url,
+    duration = COALESCE(excluded.duration, duration),
+    tag_list = COALESCE(excluded.tag_list, tag_list)
+"""
+
+
+class Catalogue(object):
+    """Local mirror of the user's library in SQLite, searched offline
+
+    `silverlining sync` copies the tracks of followed users, the user's
+    playlists, likes and play history into path. Each collection is synced
+    incrementally: newest first, stopping at the high-water mark the last
+    sync left, or for playlists only when last_modified has changed. Track
+    titles, usernames and tags are indexed with FTS5 where sqlite has it,
+    and matched with LIKE otherwise.
+    """
+    def __init__(self, path=CATALOGUE_FILE):
+        self.path = path
+        self.fts = False
+        self._db = None
+        self._lock = threading.RLock()
+
+    @property
+    def synced(self):
+        return os.path.isfile(self.path)
+
+    @property
+    def db(self):
+        if self._db is None:
+            db = sqlite3.connect(self.path, check_same_thread=False)
+            db.row_factory = sqlite3.Row
+            db.executescript(SCHEMA)
+            try:
+                db.executescript(FTS_SCHEMA)
+                self.fts = True
+            except sqlite3.OperationalError:
+                # built without fts5
+                pass
+            self._db = db
+        return self._db
+
+    def _mark(self, collection):
+        row = self.db.execute('SELECT mark FROM marks WHERE collection = ?',
+                              (collection,)).fetchone()
+        return row['mark'] if row else None
+
+    def _set_mark(self, collection, mark):
+        self.db.execute('INSERT OR REPLACE INTO marks VALUES (?, ?, ?)',
+                        (collection, None if mark is None else str(mark), time.time()))
+
+    def _store_tracks(self, tracks):
+        self.db.executemany(UPSERT_TRACK, [t.to_dict() for t in tracks])
+
+    def _prepend(self, collection, tracks):
+        """Adds tracks, newest first, ahead of the collection's others"""
+        row = self.db.execute('SELECT MIN(position) FROM collection_tracks WHERE collection = ?',
+                              (collection,)).fetchone()
+        first = (row[0] or 0) - len(tracks)
+        self._store_tracks(tracks)
+        self.db.executemany(
+            'INSERT OR REPLACE INTO collection_tracks VALUES (?, ?, ?)',
+            [(collection, t.id, first + i) for i, t in enumerate(tracks)])
+
+    def _replace(self, collection, tracks):
+        self.db.execute('DELETE FROM collection_tracks WHERE collection = ?', (collection,))
+        self._prepend(collection, tracks)
+
+    def _sync_collection(self, collection, items, full=False):
+        """Stores items from a newest first feed down to the high-water mark"""
+        mark = None if full else self._mark(collection)
+        new = []
+        for d in items:
+            if str(d['id']) == mark:
+                break
+            new.append(Track(d))
+        if full:
+            self._replace(collection, new)
+        elif new:
+            self._prepend(collection, new)
+        if new:
+            self._set_mark(collection, new[0].id)
+        return len(new)
+
+    def _sync_playlist(self, d, full=False):
+        collection = 'playlist:%s' % d['id']
+        modified = d.get('last_modified')
+        if not full and modified and modified == self._mark(collection):
+            return 0
+        # it changed since the last sync, so the response cache's copy is stale
+        try:
+            obj = client.get('/playlists/%s' % d['id']).obj
+        except requests.exceptions.HTTPError as e:
+            if e.response is None or e.response.status_code != 404:
+                raise
+            return 0
+        response_cache.store('/playlists/%s' % d['id'], {}, [obj])
+        playlist = Playlist(obj)
+        self.db.execute('INSERT OR REPLACE INTO playlists VALUES (?, ?, ?, ?, ?, ?)', (
+            playlist.id, obj.get('user_id'), playlist.title,
+            playlist.username, playlist.uri, playlist.permalink_url))
+        self._replace(collection, playlist.tracks)
+        self._set_mark(collection, modified)
+        return len(playlist.tracks)
+
+    def sync(self, out=None, full=False):
+        """Brings the catalogue up to date with SoundCloud"""
+        out = out or sys.stdout
+        with self._lock, self.db:
+            for d in soundcloud_pages('/me/playlists', representation='compact'):
+                n = self._sync_playlist(d, full)
+                out.write(u"playlist %s: %s tracks\n" % (d['title'], n))
+                if d['title'] == 'Silverlining Playlist':
+                    self._set_mark('sllist', d['id'])
+
+            n = self._sync_collection('likes', soundcloud_pages('/me/favorites'), full)
+            out.write(u"likes: %s new tracks\n" % n)
+
+            for d in soundcloud_pages('/me/followings'):
+                user = User(d)
+                self.db.execute('INSERT OR REPLACE INTO users VALUES (?, ?, ?, ?)', (
+                    user.id, user.username, user.full_name, user.permalink_url))
+                n = self._sync_collection('user:%s' % user.id,
+                                          soundcloud_pages('/users/%s/tracks' % user.id),
+                                          full)
+                out.write(u"%s: %s new tracks\n" % (user.username, n))
+
+            # played tracks are already on disk, just mirror the newest
+            history = [Track(e) for e in History().recent(RESULTS_LIMIT * 20)]
+            self._replace('history', history)
+            out.write(u"history: %s tracks\n" % len(history))
+
+    def search_tracks(self, query, collection=None, limit=RESULTS_LIMIT):
+        """Tracks matching every word of query, in collection if given
+
+        With fts5 each word matches as a prefix and the best matches come
+        first, otherwise words match anywhere in the text.
+        """
+        words = re.findall(r'\w+', query, re.UNICODE)
+        if not words:
+            return []
+        # fts is only known once the database is open
+        db = self.db
+        if self.fts:
+            sql = 'SELECT tracks.* FROM tracks_fts JOIN tracks ON tracks.id = tracks_fts.rowid'
+            where = 'tracks_fts MATCH ?'
+            params = (u' '.join(u'"%s"*' % w for w in words),)
+            order = ' ORDER BY rank'
+        else:
+            sql = 'SELECT tracks.* FROM tracks'
+            where = ' AND '.join(
+                ["(tracks.title || ' ' || tracks.username || ' ' || "
+                 "COALESCE(tracks.tag_list, '')) LIKE ?"] * len(words))
+            params = tuple(u'%%%s%%' % w for w in words)
+            order = ''
+        if collection:
+            sql += ' JOIN collection_tracks c ON c.track_id = tracks.id AND c.collection = ?'
+            params = (collection,) + params
+
+        with self._lock:
+            rows = db.execute(sql + ' WHERE ' + where + order + ' LIMIT ?',
+                                   params + (limit,)).fetchall()
+        return [Track(dict(row)) for row in rows]
+
+    def find_user(self, username):
+        with self._lock:
+            if utils.isint(username):
+                row = self.db.execute('SELECT * FROM users WHERE id = ?',
+                                      (int(username),)).fetchone()
+            else:
+                row = self.db.execute('SELECT * FROM users WHERE username = ? COLLATE NOCASE',
+                                      (username,)).fetchone()
+        return User(dict(row)) if row else None
+
+    def search_playlists(self, query, user=None, limit=RESULTS_LIMIT):
+        with self._lock:
+            sql, params = 'SELECT * FROM playlists WHERE title LIKE ?', (u'%%%s%%' % query,)
+            if user:
+                sql, params = sql + ' AND user_id = ?', params + (user.id,)
+            rows = self.db.execute(sql + ' LIMIT ?', params + (limit,)).fetchall()
+            playlists = []
+            for row in rows:
+                d = dict(row)
+                d['tracks'] = [dict(t) for t in self.db.execute(
+                    'SELECT tracks.* FROM tracks JOIN collection_tracks c'
+                    ' ON c.track_id = tracks.id AND c.collection = ?'
+                    ' ORDER BY c.position', ('playlist:%s' % d['id'],))]
+                playlists.append(Playlist(d))
+        return playlists
+
+    def search(self, username, category, query):
+        """Search results from the catalogue, or None to go to SoundCloud
+
+        Only searches of the user's library are answered locally: the
+        Silverlining Playlist, a followed user's tracks and the user's own
+        playlists. Listings and searches of all of SoundCloud still go to
+        SoundCloud, so they're never stale or cut down to what was synced.
+        """
+        if not self.synced or not query or utils.isint(query):
+            return None
+
+        if category == 'sllist':
+            playlist_id = self._mark('sllist')
+            items = playlist_id and self.search_tracks(query, 'playlist:%s' % playlist_id)
+        elif category == 'track' and username:
+            user = self.find_user(username)
+            if user is None:
+                return None
+            items = self.search_tracks(query, 'user:%s' % user.id)
+        elif category == 'playlist' and username and username.lower() == USERNAME.lower():
+            items = self.search_playlists(query)
+        else:
+            return None
+        return items or None
+
+catalogue = Catalogue()
@@ -1,14 +1,28 @@
 import cmd
+import re
 import readline
 import shlex
 import sys
 
+import requests
+
+from silverlining import (
+    LoginError,
+    utils,
+)
 from silverlining.base import (
     parse_search_arguments,
     get_search_results,
     get_search_interp,
 )
 from silverlining.models import Track
+from silverlining.stats import stats
+
+
+# words search completes besides names and titles
+SEARCH_KEYWORDS = ['me', 'stream', 'track', 'tracks', 'playlist', 'playlists']
+# an argument with any of these is meant as a range, never a word to match
+RANGE_CHARS = re.compile(r'[\d.,*-]')
 
 
 class CommandError(Exception):
@@ -23,14 +37,21 @@ class CommandMode(cmd.Cmd):
         cmd.Cmd.__init__(self, *args, **kwargs)
         self.player = player
         self._search_cache = []
+        self._search_index = utils.SearchIndex()
+        self._vocabulary = None
         self.args = []
 
+    def preloop(self):
+        if 'libedit' in (readline.__doc__ or ''):
+            # macOS python ships libedit, which ignores cmd's tab binding
+            readline.parse_and_bind('bind ^I rl_complete')
+
     def do_EOF(self, line):
         return True
 
     def parseline(self, line):
         args = super(CommandMode, self).parseline(line)[:-1]
-        if args[1] == '':
+        if not args[1]:
             cmd, self.args = args[0], []
         else:
             cmd = args[0]
@@ -56,9 +77,8 @@ class CommandMode(cmd.Cmd):
         return (cmd, args, line)
 
     def parse_range(self, r, allow_dot=True):
-        if allow_dot:
-            r.replace('.', str(self.player.current_track.idx))
-        elif '.' in r:
+        # current_idx raises when nothing is playing, only ask for it on a '.'
+        if not allow_dot and '.' in r:
             raise CommandError("self reference not supported for this command")
 
         rs = r.split(',')
@@ -67,30 +87,66 @@ class CommandMode(cmd.Cmd):
             if '-' in r:
                 s, e = r.split('-')
                 if s == '.':
-                    s = self.player.current_track.idx
+                    s = self.player.current_idx
                 if e == '.':
-                    e = self.player.current_track.idx
+                    e = self.player.current_idx
                 elif e == '*':
-                    e = self.player.num_tracks
+                    e = self.player.num_tracks - 1
                 idxes.extend(range(int(s), int(e) + 1))
             elif r == '.':
-                idxes.append(self.player.current_track.idx)
+                idxes.append(self.player.current_idx)
             else:
                 idxes.append(int(r))
 
         return sorted(list(set(idxes)))
 
+    @property
+    def vocabulary(self):
+        """Usernames and history words seen this session, built on first use"""
+        if self._vocabulary is None:
+            self._vocabulary = utils.PrefixTrie(SEARCH_KEYWORDS)
+            for entry in self.player.history.recent():
+                for word in utils.words(entry['title']) + [entry['username']]:
+                    self._vocabulary.add(word)
+        return self._vocabulary
+
+    def _complete(self, text, *indexes):
+        found = []
+        for index in indexes:
+            for word in index.complete(text):
+                if word not in found:
+                    found.append(word)
+        return found
+
+    def complete_jump(self, text, line, begidx, endidx):
+        return self._complete(text, self.player._index)
+
+    def complete_delete(self, text, line, begidx, endidx):
+        return self._complete(text, self.player._index)
+
+    def complete_enqueue(self, text, line, begidx, endidx):
+        return self._complete(text, self._search_index)
+
+    def complete_search(self, text, line, begidx, endidx):
+        return self._complete(text, self.vocabulary, self.player._index)
+
+    def _write_failed(self, tracks):
+        for track in tracks:
+            sys.stdout.write(u"failed to load %s\n" % track)
+
     def do_quit(self, line):
         return True
 
+    def do_stats(self, line):
+        sys.stdout.write(stats.report())
+
     def do_list(self, line):
-        fmt = lambda x: "{:<12} {}".format(x.idx, x)
         sys.stdout.write("Queue:\n")
-        sys.stdout.write(u'\n'.join(map(fmt, self.player.queue)))
+        sys.stdout.write(self.player._list_queue())
         sys.stdout.write('\n')
 
     def do_jump(self, line):
-        if not self.args[0]:
+        if not self.args or not self.args[0]:
             sys.stdout.write("jump requires a target, either an index or a search string\n")
             return
 
@@ -104,21 +160,22 @@ class CommandMode(cmd.Cmd):
         return
 
     def do_delete(self, line):
-        if not self.args[0]:
+        if not self.args or not self.args[0]:
             sys.stdout.write("delete takes a range argument\n")
             return
 
-        try:
-            indexes = self.parse_range(self.args[0])
-        except CommandError:
-            sys.stdout.write("invalid range\n")
-            return
-
         tracks = []
         try:
-            for i in indexes:
+            for i in self.parse_range(self.args[0]):
                 tracks.append(self.player.queue[i])
-        except IndexError:
+        except (CommandError, ValueError, IndexError):
+            if RANGE_CHARS.search(self.args[0]):
+                sys.stdout.write("invalid range\n")
+                return
+            # not a range, delete the track best matching the word
+            track = self.player.get_track(self.args[0])
+            tracks = [track] if track else []
+        if not tracks:
             sys.stdout.write("invalid range\n")
         else:
             for track in tracks:
@@ -133,22 +190,41 @@ class CommandMode(cmd.Cmd):
             sys.stdout.write("%s\n" % e)
         else:
             sys.stdout.write("Searching " + get_search_interp(username, category, query) + "\n")
-            items = get_search_results(username, category, query)
+            try:
+                items = get_search_results(username, category, query)
+            except LoginError as e:
+                sys.stdout.write("%s\n" % e)
+                return
+            except requests.exceptions.RequestException as e:
+                sys.stdout.write("SoundCloud request failed: %s\n" % e)
+                return
             fmt = lambda x: u"{:<12} {}".format(*x)
             sys.stdout.write(u"\n".join(map(fmt, enumerate(items))) + "\n")
             self._search_cache = items
+            self._search_index.clear()
+            for item in items:
+                self._search_index.add(item)
+                if item.username:
+                    self.vocabulary.add(item.username)
         return
 
     def do_enqueue(self, line):
-        if not self.args[0]:
+        if not self.args or not self.args[0]:
             sys.stdout.write("enqueue takes one argument\n")
             return
 
         try:
             indexes = self.parse_range(self.args[0])
-        except CommandError:
-            sys.stdout.write("invalid range\n")
-            return
+        except (CommandError, ValueError):
+            if RANGE_CHARS.search(self.args[0]):
+                sys.stdout.write("invalid range\n")
+                return
+            # not a range, enqueue the result best matching the word
+            indexes = [self._search_cache.index(item)
+                       for item in self._search_index.search(self.args[0], limit=1)]
+            if not indexes:
+                sys.stdout.write("invalid range\n")
+                return
 
         tracks = []
         for i in indexes:
@@ -162,12 +238,13 @@ class CommandMode(cmd.Cmd):
                 sys.stdout.write('invalid range\n')
                 return
 
-        self.player.load_tracks(tracks)
-        sys.stdout.write("Loaded %s tracks\n" % len(tracks))
+        failed = self.player.load_tracks(tracks)
+        sys.stdout.write("Loaded %s tracks\n" % (len(tracks) - len(failed)))
+        self._write_failed(failed)
         return
 
     def do_history(self, line):
-        history = self.player._history[:-50:-1]
+        history = self.player.history.recent()
         if len(self.args) == 0:
             sys.stdout.write('History:\n')
             for i, hist in enumerate(history):
@@ -180,13 +257,20 @@ class CommandMode(cmd.Cmd):
                 sys.stdout.write("invalid range\n")
                 return
 
-            tracks = []
-            for i in indexes:
-                try:
-                    tracks.append(Track.get_one(history[i]['id']))
-                except IndexError:
-                    sys.stdout.write("invalid range\n")
-                    return
+            try:
+                tracks = [Track(history[i]) for i in indexes]
+            except IndexError:
+                sys.stdout.write("invalid range\n")
+                return
+
+            # refresh the stored fields in one batched lookup
+            try:
+                fresh = Track.get_many([track['id'] for track in tracks])
+            except (LoginError, requests.exceptions.RequestException):
+                # the stored fields will do
+                fresh = {}
+            tracks = [fresh.get(track['id'], track) for track in tracks]
 
-            self.player.load_tracks(tracks)
-            sys.stdout.write('loaded %s tracks\n' % len(tracks))
+            failed = self.player.load_tracks(tracks)
+            sys.stdout.write('loaded %s tracks\n' % (len(tracks) - len(failed)))
+            self._write_failed(failed)
@@ -0,0 +1,74 @@
+import os
+import sys
+
+import simplejson
+
+from silverlining import (
+    CONFIG_FILE,
+    DOT_FILES,
+)
+
+
+# settings config.json has to have, by the name they're imported as
+REQUIRED = {
+    'CLIENT_ID': 'client_id',
+    'SECRET_KEY': 'secret_key',
+    'USERNAME': 'username',
+    'PASSWORD': 'password',
+}
+
+# optional settings, name: (key in config.json, default)
+OPTIONAL = {
+    'CACHE_MAX_BYTES': ('cache_max_bytes', 64 * 1024 * 1024),
+    'PAGE_SIZE': ('page_size', 50),
+    'RESULTS_LIMIT': ('results_limit', 50),
+    'PREFETCH_TRACKS': ('prefetch_tracks', 3),
+    'PREFETCH_WARM_BYTES': ('prefetch_warm_bytes', 256 * 1024),
+    'AUDIO_CACHE_BYTES': ('audio_cache_bytes', 1024 * 1024 * 1024),
+    'HISTORY_SIZE': ('history_size', 1000),
+    'RADIO_THRESHOLD': ('radio_threshold', 5),
+    'RADIO_REQUESTS_PER_HOUR': ('radio_requests_per_hour', 60),
+    'STATS_ENABLED': ('stats', False),
+    'API_URL': ('api_url', 'https://api.soundcloud.com'),
+    'API_V2_URL': ('api_v2_url', 'https://api-v2.soundcloud.com'),
+    'API_REQUESTS_PER_SECOND': ('api_requests_per_second', 10),
+    'API_BURST': ('api_burst', 20),
+    'VLC_URL': ('vlc_url', 'http://localhost:8080/requests/'),
+    'VLC_COMMAND': ('vlc_command', ['/Applications/VLC.app/Contents/MacOS/VLC']),
+}
+
+NAMES = set(REQUIRED) | set(OPTIONAL)
+
+
+def load():
+    """Reads config.json, returns its settings by name
+
+    Exits with instructions when there's no usable config yet.
+    """
+    try:
+        with open(CONFIG_FILE, 'rb') as f:
+            config = simplejson.loads(f.read())
+
+        settings = {name: config[key] for name, key in REQUIRED.items()}
+        for name, (key, default) in OPTIONAL.items():
+            settings[name] = config.get(key, default)
+        return settings
+
+    except Exception as e:
+        if not os.path.isdir(DOT_FILES):
+            os.mkdir(DOT_FILES)
+
+        if not os.path.isfile(CONFIG_FILE):
+            with open(CONFIG_FILE, 'w') as f:
+                f.write(simplejson.dumps(
+                    {'client_id': '', 'secret_key': '', 'username': '', 'password': ''},
+                    indent=2,
+                ))
+
+        sys.stdout.write(
+            "Need to enter your api and login credentials for SoundCloud.\n"
+            "Please edit %s.\n\n" % CONFIG_FILE +
+            "If you need to sign up for an API key, please visit "
+            "http://soundcloud.com/you/apps and create an app.\n"
+        )
+        sys.exit(1)
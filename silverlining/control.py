@@ -0,0 +1,43 @@
+import json
+import socket
+import sys
+
+from silverlining import SOCKET_FILE
+
+
+# commands that only make sense with a daemon to run them
+DAEMON_COMMANDS = ['e', 'enqueue', 'status', 'l', 'list', 'n', 'next', 'pause', 'stop']
+
+
+def is_running(path=SOCKET_FILE):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except socket.error:
+        return False
+    finally:
+        sock.close()
+    return True
+
+
+def send(cmd, args, path=SOCKET_FILE):
+    """Runs a command in the daemon and streams its output to stdout
+
+    Returns False without doing anything if no daemon is listening. Only
+    the standard library is used, so handing a command off stays cheap.
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except socket.error:
+        sock.close()
+        return False
+
+    with sock:
+        request = json.dumps({'cmd': cmd, 'args': list(args or [])}) + '\n'
+        sock.sendall(request.encode('utf-8'))
+        with sock.makefile('r', encoding='utf-8') as f:
+            for line in f:
+                sys.stdout.write(line)
+                sys.stdout.flush()
+    return True
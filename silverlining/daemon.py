@@ -0,0 +1,143 @@
+import os
+import socket
+import socketserver
+import sys
+import threading
+
+import simplejson
+
+from silverlining import SOCKET_FILE
+from silverlining.base import (
+    get_play_tracks,
+    get_search_interp,
+    get_search_results,
+    parse_search_arguments,
+)
+from silverlining.catalogue import catalogue
+from silverlining.control import is_running
+from silverlining.vlc import Player
+
+
+class SocketWriter(object):
+    """Writes output back to a client as soon as it's produced"""
+    def __init__(self, wfile):
+        self.wfile = wfile
+
+    def write(self, text):
+        self.wfile.write(text.encode('utf-8'))
+        self.wfile.flush()
+
+
+class DaemonHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        out = SocketWriter(self.wfile)
+        line = self.rfile.readline()
+        if not line:
+            # just checking whether the daemon is up
+            return
+        try:
+            request = simplejson.loads(line.decode('utf-8'))
+            self.server.daemon.execute(request.get('cmd'), request.get('args') or [], out)
+        except socket.error:
+            # the client went away
+            pass
+        except Exception as e:
+            out.write(u"%s\n" % e)
+
+
+class DaemonServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, daemon):
+        socketserver.ThreadingUnixStreamServer.__init__(self, path, DaemonHandler)
+        os.chmod(path, 0o600)
+        self.daemon = daemon
+
+
+class Daemon(object):
+    """Long lived player that silverlining commands are forwarded to
+
+    The client, the caches and a headless Player stay warm between
+    commands, which arrive over a Unix socket at path as a line of json,
+    {"cmd": ..., "args": [...]}. Output is written back to the socket as
+    it's produced and the connection is closed once the command is done.
+    """
+    def __init__(self, path=SOCKET_FILE):
+        self.path = path
+        self.player = None
+
+    def serve(self):
+        if is_running(self.path):
+            sys.stdout.write("silverlining is already running\n")
+            return
+        if os.path.exists(self.path):
+            # left behind by a daemon that didn't shut down cleanly
+            os.remove(self.path)
+
+        server = DaemonServer(self.path, self)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        try:
+            with Player(no_input=True) as player:
+                self.player = player
+                thread.start()
+                player.run()
+        finally:
+            if thread.is_alive():
+                server.shutdown()
+            server.server_close()
+            os.remove(self.path)
+
+    def execute(self, cmd, args, out):
+        player = self.player
+        if cmd == 'status':
+            out.write(u"%s\n" % player.now_playing)
+            out.write(u"radio %s\n" % ('on' if player.radio.enabled else 'off'))
+        elif cmd in ['l', 'list']:
+            out.write(player._list_queue() + u"\n")
+        elif cmd in ['n', 'next']:
+            out.write(player.next() + u"\n")
+        elif cmd == 'pause':
+            player.pause()
+        elif cmd == 'stop':
+            out.write(player.quit() + u"\n")
+        elif cmd == 'sync':
+            catalogue.sync(out, full='full' in args)
+        else:
+            username, category, query = parse_search_arguments(args)
+            if cmd in ['s', 'search'] or not cmd:
+                self.search(username, category, query, out)
+            elif cmd in ['p', 'play']:
+                self.play(username, category, query, out)
+            elif cmd in ['r', 'radio']:
+                self.play(username, category, query, out, radio=True)
+            elif cmd in ['e', 'enqueue']:
+                self.play(username, category, query, out, replace=False)
+            else:
+                out.write("Unrecognized command %s\n" % cmd)
+        player._poll_soon()
+
+    def search(self, username, category, query, out):
+        out.write("Searching " + get_search_interp(username, category, query) + "\n")
+        items = get_search_results(username, category, query)
+        out.write(u"\n".join([i.cli_display for i in items]) + u"\n")
+
+    def play(self, username, category, query, out, replace=True, radio=False):
+        verb = "Playing " if replace else "Enqueueing "
+        out.write(verb + get_search_interp(username, category, query, 'play') + "\n")
+        tracks = get_play_tracks(get_search_results(username, category, query), category)
+        if not tracks:
+            out.write("Nothing found.\n")
+            return
+
+        player = self.player
+        with player._queue_lock:
+            if replace:
+                player.clear_queue()
+            failed = player.load_tracks(tracks)
+        if replace:
+            player.radio.enabled = radio
+            player.play()
+        out.write(u"Loaded %s tracks\n" % (len(tracks) - len(failed)))
+        for track in failed:
+            out.write(u"failed to load %s\n" % track)
@@ -0,0 +1,70 @@
+from silverlining import utils
+
+
+def parse_search_arguments(args):
+    if not args or args[0] == '':
+        return None, 'sllist', None
+    if args[0].startswith('http'):
+        # it's a url
+        from silverlining.base import resolve_url
+        kind, item_id = resolve_url(args[0])
+        return None, kind, item_id
+    elif len(args) == 1 and utils.isint(args[0]):
+        # it's an id, could be a track or a playlist
+        from silverlining.base import resolve_id
+        return None, resolve_id(args[0]), args[0]
+    elif args[0] in ['me', 'stream']:
+        if len(args) > 1:
+            return 'me', 'stream', args[1]
+        return 'me', 'stream', None
+    elif args[0] in ['t', 'track', 'tracks']:
+        if len(args) > 1:
+            return None, 'track', args[1]
+        raise Exception("not enough arguments")
+    elif args[0] in ['p', 'playlist', 'playlists']:
+        if len(args) > 1:
+            return None, 'playlist', args[1]
+        raise Exception("not enough arguments")
+    else:
+        if len(args) == 1:
+            return args[0], 'user', None
+        elif args[1] in ['t', 'track', 'tracks']:
+            if len(args) > 2:
+                return args[0], 'track', args[2]
+            return args[0], 'track', None
+        elif args[1] in ['p', 'playlist', 'playlists']:
+            if len(args) > 2:
+                return args[0], 'playlist', args[2]
+            return args[0], 'playlist', None
+        elif args[1] in ['s', 'stream']:
+            if len(args) > 2:
+                return args[0], 'stream', args[2]
+            return args[0], 'stream', None
+    raise Exception("unable to parse command %s" % ' '.join(args))
+
+
+def get_search_interp(username, category, query, action='search'):
+    interp = ""
+    if category == 'sllist':
+        interp += "silverlining playlist"
+    elif category == 'stream':
+        if username == 'me':
+            interp += "your stream"
+        else:
+            interp = "%s's stream" % username
+    elif username:
+        if category == 'user':
+            if action == 'search':
+                interp += "users matching %s" % username
+            else:
+                interp += "%s's stream" % username
+        else:
+            interp += "%s's %ss" % (username, category)
+    else:
+        if query and utils.isint(query):
+            interp += "%s id %s" % (category, query)
+        else:
+            interp += "%ss" % category
+    if query and not utils.isint(query):
+        interp += " for %s" % query
+    return interp
@@ -0,0 +1,152 @@
+import os
+import tempfile
+
+import simplejson
+
+from silverlining import (
+    HISTORY_SIZE,
+    HIST_FILE,
+    LEGACY_HIST_FILE,
+)
+
+
+# number of tracks the history command lists
+RECENT = 50
+# check whether the journal needs compacting every this many appends
+COMPACT_EVERY = 100
+BLOCK_SIZE = 64 * 1024
+
+
+class History(object):
+    """Append-only journal of played tracks
+
+    Every track is written to HIST_FILE as a line of json as soon as it's
+    played, so a crash doesn't lose the session's history. Recent entries
+    are read from the tail of the file, newest first. Once the journal has
+    grown to about twice max_entries it's compacted down to the newest
+    max_entries, a max_entries of 0 keeps everything.
+    """
+    def __init__(self, path=HIST_FILE, max_entries=HISTORY_SIZE):
+        self.path = path
+        self.max_entries = max_entries
+        self._recent = None
+        self._exhausted = False
+        self._line_size = 200
+        self._appends = 0
+        if not os.path.isfile(self.path):
+            self._migrate()
+        self._torn = self._ends_with_torn_line()
+
+    def _migrate(self):
+        """Converts the history.json written by older versions"""
+        try:
+            with open(LEGACY_HIST_FILE, 'rb') as f:
+                entries = simplejson.loads(f.read())
+        except (IOError, ValueError):
+            return
+        # the old format was newest first
+        self._rewrite(reversed(entries))
+        os.remove(LEGACY_HIST_FILE)
+
+    def _ends_with_torn_line(self):
+        try:
+            with open(self.path, 'rb') as f:
+                f.seek(-1, os.SEEK_END)
+                return f.read(1) != b'\n'
+        except (IOError, OSError):
+            return False
+
+    def append(self, entry):
+        line = simplejson.dumps(entry) + '\n'
+        if self._torn:
+            # don't glue this entry onto a line cut short by a crash
+            line = '\n' + line
+            self._torn = False
+        with open(self.path, 'a') as f:
+            f.write(line)
+
+        if self._recent is not None:
+            self._recent = [e for e in self._recent if e['id'] != entry['id']]
+            self._recent.insert(0, entry)
+
+        self._appends += 1
+        if self._appends % COMPACT_EVERY == 0:
+            self.compact_if_needed()
+
+    def recent(self, n=RECENT):
+        """Returns the n most recently played distinct tracks, newest first"""
+        if self._recent is None or (len(self._recent) < n and not self._exhausted):
+            self._recent = self._tail(n)
+            self._exhausted = len(self._recent) < n
+        return self._recent[:n]
+
+    def _tail(self, n):
+        """Reads distinct entries backwards from the end of the file"""
+        entries, seen = [], set()
+        lines_read = bytes_read = 0
+
+        def parse(line):
+            try:
+                entry = simplejson.loads(line)
+            except ValueError:
+                # a line cut short by a crash
+                return
+            if entry['id'] not in seen:
+                seen.add(entry['id'])
+                entries.append(entry)
+
+        try:
+            f = open(self.path, 'rb')
+        except IOError:
+            return entries
+
+        with f:
+            f.seek(0, os.SEEK_END)
+            pos = f.tell()
+            buf = b''
+            while pos > 0 and len(entries) < n:
+                size = min(BLOCK_SIZE, pos)
+                pos -= size
+                f.seek(pos)
+                buf = f.read(size) + buf
+                lines = buf.split(b'\n')
+                buf = lines[0]
+                for line in reversed(lines[1:]):
+                    if line and len(entries) < n:
+                        parse(line.decode('utf-8'))
+                        lines_read += 1
+                        bytes_read += len(line) + 1
+            if pos == 0 and buf and len(entries) < n:
+                parse(buf.decode('utf-8'))
+
+        if lines_read:
+            self._line_size = bytes_read // lines_read
+        return entries
+
+    def compact_if_needed(self):
+        if not self.max_entries:
+            return
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            return
+        if size > 2 * self.max_entries * self._line_size:
+            self.compact()
+
+    def compact(self):
+        """Rewrites the journal as its newest max_entries distinct tracks"""
+        entries = self._tail(self.max_entries or float('inf'))
+        self._rewrite(reversed(entries))
+        self._recent = None
+
+    def _rewrite(self, entries):
+        """Atomically replaces the journal with entries, oldest first"""
+        directory = os.path.dirname(self.path)
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            for entry in entries:
+                f.write(simplejson.dumps(entry) + '\n')
+        os.rename(tmp, self.path)
+
+    def close(self):
+        self.compact_if_needed()
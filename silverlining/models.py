@@ -1,28 +1,77 @@
+import itertools
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
 import requests
-import soundcloud
+import simplejson
 
 from silverlining import (
+    API_V2_URL,
     CLIENT_ID,
+    LoginError,
+    PAGE_SIZE,
+    PLAYLIST_FILE,
+    RESULTS_LIMIT,
+    USERNAME,
     client,
+    stream,
     utils,
 )
+from silverlining.cache import (
+    NEGATIVE_TTL,
+    cached_get,
+    response_cache,
+)
+from silverlining.timeline import Timeline
+from silverlining.transport import transport
 
 
-def soundcloud_get(*args, **kwargs):
+def soundcloud_get(endpoint, **kwargs):
+    """Results for endpoint as a list of dicts, [] if it doesn't exist
+
+    Responses are cached and revalidated like cached_get's. Other errors
+    are raised once the transport has given up retrying.
+    """
+    get = lambda headers: client.response('get', endpoint, kwargs, headers)
     try:
-        results = client.get(*args, **kwargs)
-    except requests.exceptions.HTTPError:
+        data = cached_get(endpoint, kwargs, get)
+    except requests.exceptions.HTTPError as e:
+        if e.response is None or e.response.status_code != 404:
+            raise
+        response_cache.store(endpoint, kwargs, [], ttl=NEGATIVE_TTL)
         return []
+    return data if isinstance(data, list) else [data]
+
+
+# most /tracks?ids= lookups the API will answer in one request
+IDS_PER_REQUEST = 50
+# concurrent requests when falling back to fetching tracks one by one
+FALLBACK_WORKERS = 4
+# tracks listed or played from a stream
+STREAM_LIMIT = 100
+
+
+def soundcloud_pages(endpoint, page_size=PAGE_SIZE, **kwargs):
+    """Lazily yields items from a collection, following next_href cursors"""
+    kwargs.update(limit=page_size, linked_partitioning=1)
+    while endpoint:
+        pages = soundcloud_get(endpoint, **kwargs)
+        if not pages:
+            return
+        for item in pages[0].get('collection', []):
+            yield item
+        endpoint, kwargs = pages[0].get('next_href'), {}
 
-    if isinstance(results, soundcloud.resource.Resource):
-        return [results.obj]
-    elif isinstance(results, soundcloud.resource.ResourceList):
-        return list(map(lambda x: x.obj, results))
+
+def page_size_for(limit):
+    """Smallest page size that can satisfy limit in one request"""
+    return PAGE_SIZE if limit is None else min(PAGE_SIZE, limit)
 
 
 class UserNotFoundError(Exception):
     def __init__(self, username):
-        if utils.isint(query):
+        if utils.isint(username):
             msg = u"User with id %s not found" % username
         else:
             msg = u"No user found for %s" % username
@@ -51,7 +100,58 @@ class PlaylistNotFoundError(Exception):
         super(PlaylistNotFoundError, self).__init__(msg)
 
 
-class User(dict):
+class Record(object):
+    """Compact stand-in for an API object
+
+    Only the fields the player and CLI use are kept, in __slots__. They can
+    be read as attributes or by key like the dicts these used to be. Other
+    keys are looked up in the full payload, which is fetched (through the
+    response cache) only when asked for.
+    """
+    __slots__ = ()
+    kind = None
+    _fields = ()
+    _endpoint = None
+
+    def __init__(self, d):
+        if isinstance(d, Record):
+            d = {field: getattr(d, field) for field in d._fields}
+        for field in self._fields:
+            setattr(self, field, d.get(field))
+        if 'username' in self._fields:
+            # usernames repeat a lot across a queue
+            self.username = sys.intern(self.username or d['user']['username'])
+
+    def __getitem__(self, key):
+        if key == 'kind':
+            return self.kind
+        if key in self._fields:
+            return getattr(self, key)
+        return self.raw[key]
+
+    def __eq__(self, other):
+        return (isinstance(other, Record) and
+                (self.kind, self.id) == (other.kind, other.id))
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((self.kind, self.id))
+
+    @property
+    def raw(self):
+        """Full API payload"""
+        items = soundcloud_get(self._endpoint % self.id)
+        return items[0] if items else {}
+
+
+class User(Record):
+    kind = 'user'
+    _fields = ('id', 'username', 'full_name', 'permalink_url')
+    _endpoint = '/users/%s'
+    __slots__ = _fields
+
     @classmethod
     def get(cls, username=None):
         if utils.isint(username):
@@ -68,134 +168,317 @@ class User(dict):
             raise UserNotFoundError(username)
 
     def __repr__(self):
-        return u"%s" % self['username']
+        return u"%s" % self.username
 
     @property
     def cli_display(self):
-        return u'{:<12} {:24} {}'.format(self['id'], self['username'], self['full_name'])
+        return u'{:<12} {:24} {}'.format(self.id, self.username, self.full_name)
+
+    def get_tracks(self, page_size=PAGE_SIZE):
+        pages = soundcloud_pages('/users/%s/tracks' % self.id, page_size)
+        return (Track(track) for track in pages)
+
+    def get_playlists(self, page_size=PAGE_SIZE):
+        pages = soundcloud_pages('/users/%s/playlists' % self.id, page_size)
+        return (Playlist(playlist) for playlist in pages)
 
     @property
     def tracks(self):
-        return list(map(Track, soundcloud_get('/users/%s/tracks' % self['id'])))
+        return self.get_tracks()
 
     @property
     def playlists(self):
-        return list(map(Playlist, soundcloud_get('/users/%s/playlists.json?limit=10' % self['id'])))
+        return self.get_playlists()
+
+    @property
+    def timeline(self):
+        def extract(item):
+            if item['type'] in ['track', 'track-repost']:
+                return Track(item['track']).to_dict()
+
+        url = API_V2_URL + "/profile/soundcloud:users:%s?limit=100"
+
+        def fetch(url):
+            resp = transport.get(url)
+            resp.raise_for_status()
+            return resp.json()
+
+        return Timeline('user-%s' % self.id, url % self.id, fetch, extract)
 
     @property
     def stream(self):
-        url = "https://api-v2.soundcloud.com/profile/soundcloud:users:%s?limit=100"
-        items = requests.get(url % self['id']).json()['collection']
-        return list(
-            map(Track,
-                map(lambda x: x['track'],
-                    filter(lambda x: x['type'] in ['track', 'track-repost'],
-                           items))))
+        return list(map(Track, itertools.islice(self.timeline.tracks(), STREAM_LIMIT)))
 
 
-class Track(dict):
-    def __init__(self, d):
-        super(Track, self).__init__(d)
-        if not 'username' in self:
-            self['username'] = self['user']['username']
+class Track(Record):
+    kind = 'track'
+    _fields = ('id', 'title', 'username', 'stream_url', 'permalink_url',
+               'duration', 'tag_list')
+    _endpoint = '/tracks/%s'
+    # plid is the track's id in VLC's playlist
+    __slots__ = _fields + ('plid',)
 
     @classmethod
-    def get(cls, query=None, user=None):
+    def get(cls, query=None, user=None, limit=RESULTS_LIMIT):
         if query and utils.isint(query):
-            tracks = soundcloud_get('/tracks/%s' % query)
-            if not tracks:
-                raise TrackNotFoundError(query)
-            track = cls(tracks[0])
-            tracks.extend(track.get_related())
-            return [cls(track) for track in tracks]
-
-        if user:
-            tracks = user.tracks
-            if query:
-                tracks = utils.search_collection(tracks, query)
+            track = cls.get_by_id(query)
+            return [track] + track.get_related()
+
+        if user and query:
+            tracks = utils.search_collection(user.tracks, query)
+        elif user:
+            tracks = user.get_tracks(page_size_for(limit))
         else:
-            tracks = soundcloud_get('/tracks', q=query)
-        return list(map(cls, tracks))
+            tracks = soundcloud_pages('/tracks', page_size_for(limit), q=query)
+        return list(map(cls, itertools.islice(tracks, limit)))
 
     @classmethod
     def get_one(cls, query=None, user=None):
         try:
-            return cls.get(query, user)[0]
+            return cls.get(query, user, limit=1)[0]
         except IndexError:
             raise TrackNotFoundError(query, user)
 
+    @classmethod
+    def get_by_id(cls, track_id):
+        """Fetches just the track, without its related tracks"""
+        tracks = soundcloud_get('/tracks/%s' % track_id)
+        if not tracks:
+            raise TrackNotFoundError(track_id)
+        return cls(tracks[0])
+
+    @classmethod
+    def get_many(cls, track_ids):
+        """Returns {id: track} for the given ids, batched into /tracks?ids=
+
+        Ids the batch lookup didn't return are fetched individually, a few at
+        a time. Ids that can't be found are left out.
+        """
+        track_ids = [int(i) for i in track_ids]
+        found = {}
+        for i in range(0, len(track_ids), IDS_PER_REQUEST):
+            batch = track_ids[i:i + IDS_PER_REQUEST]
+            for d in soundcloud_get('/tracks', ids=','.join(map(str, batch))):
+                response_cache.store('/tracks/%s' % d['id'], {}, [d])
+                found[d['id']] = cls(d)
+
+        def fetch(track_id):
+            try:
+                return cls.get_by_id(track_id)
+            except TrackNotFoundError:
+                return None
+
+        missing = [i for i in track_ids if i not in found]
+        if missing:
+            with ThreadPoolExecutor(FALLBACK_WORKERS) as pool:
+                for track in pool.map(fetch, missing):
+                    if track:
+                        found[track.id] = track
+        return found
+
     @classmethod
     def get_from_stream(cls, query=None):
-        resp = soundcloud_get('/me/activities/tracks/affiliated')
-        tracks = [cls(i['origin']) for i in resp[0]['collection']]
+        def extract(item):
+            if item.get('origin'):
+                return cls(item['origin']).to_dict()
+
+        timeline = Timeline('me', '/me/activities/tracks/affiliated?limit=%s' % PAGE_SIZE,
+                            lambda url: client.get(url).obj, extract)
+        tracks = list(map(cls, itertools.islice(timeline.tracks(), STREAM_LIMIT)))
         if query:
             tracks = utils.search_collection(tracks, query)
         return tracks
 
     def get_related(self):
-        resp = soundcloud_get('/tracks/%s/related' % self['id'])
+        resp = soundcloud_get('/tracks/%s/related' % self.id)
         tracks = [Track(i) for i in resp]
         return tracks
 
+    def to_dict(self):
+        return {field: getattr(self, field) for field in self._fields}
+
     def __repr__(self):
-        return u"%s - %s" % (self['username'], self['title'])
+        return u"%s - %s" % (self.username, self.title)
 
     @property
     def cli_display(self):
-        return u"{:<12} {}".format(self['id'], self)
+        return u"{:<12} {}".format(self.id, self)
+
+    @property
+    def api_stream_uri(self):
+        return self.stream_url + '?client_id=%s' % CLIENT_ID
 
     @property
     def stream_uri(self):
-        return self['stream_url'] + '?client_id=%s' % CLIENT_ID
+        """URI for VLC to play, through the local stream server if it's up"""
+        return stream.local_uri(self) or self.api_stream_uri
+
 
+class Playlist(Record):
+    kind = 'playlist'
+    _fields = ('id', 'title', 'username', 'uri', 'permalink_url', 'tracks')
+    _endpoint = '/playlists/%s'
+    __slots__ = _fields
 
-class Playlist(dict):
     @classmethod
-    def get(cls, query=None, user=None):
+    def get(cls, query=None, user=None, limit=RESULTS_LIMIT):
         if query and utils.isint(query):
-            playlists = soundcloud_get('/playlists/%s' % query)
-            if not playlists:
-                raise PlaylistNotFoundError(query)
-            return cls(playlists[0]).tracks
-
-        if user:
-            playlists = user.playlists
-            if query:
-                playlists = utils.search_collection(playlists, query)
+            return cls.get_by_id(query).tracks
+
+        if user and query:
+            playlists = utils.search_collection(user.playlists, query)
+        elif user:
+            playlists = user.get_playlists(page_size_for(limit))
         else:
-            playlists = soundcloud_get('/playlists', q=query)
-        return list(map(cls, playlists))
+            playlists = soundcloud_pages('/playlists', page_size_for(limit), q=query)
+        return list(map(cls, itertools.islice(playlists, limit)))
 
     @classmethod
     def get_one(cls, query=None, user=None):
         try:
-            return cls.get(query, user)[0]
+            return cls.get(query, user, limit=1)[0]
         except IndexError:
             raise PlaylistNotFoundError(query, user)
 
+    @classmethod
+    def get_by_id(cls, playlist_id):
+        playlists = soundcloud_get('/playlists/%s' % playlist_id)
+        if not playlists:
+            raise PlaylistNotFoundError(playlist_id)
+        return cls(playlists[0])
+
     def __init__(self, d):
         super(Playlist, self).__init__(d)
+        self.tracks = tuple(map(Track, self.tracks or ()))
 
     def __repr__(self):
-        return u"%s - %s" % (self['user']['username'], self['title'])
+        return u"%s - %s" % (self.username, self.title)
 
     @property
     def cli_display(self):
-        return u"{:<12} {}".format(self['id'], self)
+        return u"{:<12} {}".format(self.id, self)
+
+
+class SilverliningPlaylist(object):
+    """Handle on the user's Silverlining Playlist
+
+    The playlist's id is cached in PLAYLIST_FILE, so it only has to be found
+    among the user's playlists once. Added tracks are collected locally and
+    flushed in a single PUT once no more have been added for FLUSH_DELAY
+    seconds, merged against a fresh copy so edits made elsewhere are kept.
+    Adds that still can't be flushed on exit are kept in PLAYLIST_FILE and
+    go out with the next flush.
+    """
+    title = 'Silverlining Playlist'
+    # seconds to wait for more adds before writing them to SoundCloud
+    FLUSH_DELAY = 3
+
+    def __init__(self):
+        self._id = None
+        self._pending = []
+        self._lock = threading.Lock()
+        self._timer = None
+
+    @property
+    def id(self):
+        if self._id is None:
+            self._id = self._load_id() or self._find_id()
+        return self._id
+
+    def _load(self):
+        """What PLAYLIST_FILE holds for the configured user"""
+        try:
+            with open(PLAYLIST_FILE, 'rb') as f:
+                cached = simplejson.loads(f.read())
+        except (IOError, ValueError):
+            return {}
+        if cached.get('username') != USERNAME:
+            return {}
+        return cached
+
+    def _load_id(self):
+        return self._load().get('id')
+
+    def _save(self, playlist_id, pending):
+        with open(PLAYLIST_FILE, 'w') as f:
+            f.write(simplejson.dumps({'username': USERNAME, 'id': playlist_id,
+                                      'pending': pending}))
+
+    def _find_id(self):
+        for playlist in soundcloud_pages('/me/playlists', representation='compact'):
+            if playlist['title'] == self.title:
+                break
+        else:
+            playlist = client.post('/playlists', playlist={
+                'title': self.title, 'sharing': 'private'}).obj
+
+        self._save(playlist['id'], self._load().get('pending', []))
+        return playlist['id']
+
+    def fetch(self):
+        """Returns the playlist as it is on SoundCloud right now"""
+        try:
+            return Playlist(client.get('/playlists/%s' % self.id).obj)
+        except requests.exceptions.HTTPError as e:
+            if e.response is None or e.response.status_code != 404:
+                raise
+        # deleted since we cached its id
+        self._id = self._find_id()
+        return Playlist(client.get('/playlists/%s' % self.id).obj)
 
     @property
     def tracks(self):
-        return list(map(Track, self['tracks']))
+        return self.fetch().tracks
+
+    def add(self, track):
+        with self._lock:
+            if track.id not in self._pending:
+                self._pending.append(track.id)
+            if self._timer:
+                self._timer.cancel()
+            self._timer = threading.Timer(self.FLUSH_DELAY, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def flush(self):
+        """Writes pending adds to SoundCloud in one request"""
+        with self._lock:
+            pending, self._pending = self._pending, []
+            self._timer = None
+        # left over from a run that couldn't flush them
+        saved = self._load().get('pending', [])
+        pending = saved + [i for i in pending if i not in saved]
+        if not pending:
+            return
+
+        try:
+            ids = [track.id for track in self.fetch().tracks]
+            new = [i for i in pending if i not in ids]
+            if new:
+                client.put('/playlists/%s' % self.id, playlist={
+                    'tracks': [{'id': i} for i in ids + new]})
+            if saved:
+                self._save(self.id, [])
+        except (LoginError, requests.exceptions.RequestException):
+            # try again with the next add or on exit
+            with self._lock:
+                self._pending = pending + [i for i in self._pending if i not in pending]
+
+    def close(self):
+        with self._lock:
+            if self._timer:
+                self._timer.cancel()
+        self.flush()
+        with self._lock:
+            pending = self._pending
+        if pending:
+            self._save(self._id, pending)
+            sys.stdout.write("Couldn't add %s tracks to the %s, they'll be added next time.\n"
+                             % (len(pending), self.title))
+
+
+silverlining_playlist = SilverliningPlaylist()
 
 
 def get_silverlining_playlist():
-    for playlist in client.get('me/playlists'):
-        if playlist.title == 'Silverlining Playlist':
-            playlist = Playlist(playlist.obj)
-            break
-    else:
-        resp = client.post('/playlists', playlist={
-            'title': 'Silverlining Playlist', 'sharing': 'private'})
-        playlist = Playlist(resp.obj)
-
-    return playlist
+    return silverlining_playlist.fetch()
@@ -0,0 +1,92 @@
+import itertools
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from silverlining import (
+    RADIO_REQUESTS_PER_HOUR,
+    RADIO_THRESHOLD,
+    utils,
+)
+from silverlining.models import Track
+
+
+# recently played tracks to find related tracks for on each top up
+SEEDS = 3
+# recently played tracks radio won't queue again, and looks through for seeds
+PLAYED_WINDOW = 500
+# seconds before a track can seed a top up again
+SEED_COOLDOWN = 60 * 60
+
+
+class Radio(object):
+    """Keeps the player's queue topped up with related tracks
+
+    Whenever the queue drops below threshold, tracks related to the current
+    and most recently played tracks are fetched on one of the player's
+    workers, so playback never waits on them. Candidates already queued or
+    recently played are skipped, and the fetches are capped at
+    requests_per_hour. A track only seeds again after SEED_COOLDOWN, older
+    plays are used until then.
+    """
+    def __init__(self, player, threshold=RADIO_THRESHOLD,
+                 requests_per_hour=RADIO_REQUESTS_PER_HOUR):
+        self.player = player
+        self.threshold = threshold
+        self.enabled = False
+        self._budget = utils.RequestBudget(requests_per_hour, 3600)
+        self._filling = False
+        # track id: when it last seeded a top up
+        self._used_seeds = {}
+
+    def check(self):
+        """Starts topping up the queue if it's running low"""
+        if not self.enabled or self._filling or self.player.num_tracks >= self.threshold:
+            return
+        self._filling = True
+        self.player._workers.submit(self._fill)
+
+    def _seeds(self):
+        now = time.time()
+        self._used_seeds = {track_id: used for track_id, used in self._used_seeds.items()
+                            if used > now - SEED_COOLDOWN}
+        candidates = itertools.chain(
+            [self.player.current_track] if self.player.current_track else [],
+            (Track(e) for e in self.player.history.recent(PLAYED_WINDOW)))
+
+        seeds = []
+        for track in candidates:
+            if track.id in self._used_seeds or track in seeds:
+                continue
+            if len(seeds) == SEEDS or not self._budget.take():
+                break
+            seeds.append(track)
+        return seeds
+
+    def _fill(self):
+        try:
+            seeds = self._seeds()
+            if not seeds:
+                return
+            with ThreadPoolExecutor(len(seeds)) as pool:
+                related = list(pool.map(Track.get_related, seeds))
+            now = time.time()
+            self._used_seeds.update((seed.id, now) for seed in seeds)
+
+            skip = set(self.player._tracks)
+            skip.update(e['id'] for e in self.player.history.recent(PLAYED_WINDOW))
+            tracks = []
+            # alternate between seeds so one doesn't crowd out the others
+            for track in itertools.chain(*itertools.zip_longest(*related)):
+                if track is None or track.id in skip:
+                    continue
+                skip.add(track.id)
+                tracks.append(track)
+
+            if tracks:
+                failed = self.player.load_tracks(tracks)
+                self.player._notify(u"Radio added %s tracks" % (len(tracks) - len(failed)))
+        except Exception as e:
+            self.player._notify(u"Radio failed: %s" % e)
+        finally:
+            self._filling = False
+            self.player._poll_soon()
@@ -0,0 +1,177 @@
+import atexit
+import bisect
+import os
+import re
+import signal
+import tempfile
+import threading
+import time
+from urllib.parse import urlparse
+
+import simplejson
+
+from silverlining import (
+    API_V2_URL,
+    STATS_ENABLED,
+    STATS_FILE,
+)
+
+
+# upper bounds of the latency histogram's buckets in milliseconds
+BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+
+def endpoint_family(url):
+    """Groups urls by path with ids blanked out, /tracks/123 -> /tracks/#"""
+    parsed = urlparse(url)
+    path = re.sub(r'\d+', '#', parsed.path)
+    if parsed.netloc == urlparse(API_V2_URL).netloc:
+        path = '/v2' + path
+    return path
+
+
+class Metric(object):
+    __slots__ = ('count', 'errors', 'bytes', 'seconds', 'buckets')
+
+    def __init__(self):
+        self.count = self.errors = self.bytes = 0
+        self.seconds = 0.0
+        self.buckets = [0] * (len(BUCKETS) + 1)
+
+    def add(self, seconds, nbytes, error):
+        self.count += 1
+        self.errors += error
+        self.bytes += nbytes
+        self.seconds += seconds
+        self.buckets[bisect.bisect_left(BUCKETS, seconds * 1000)] += 1
+
+    def percentile(self, p):
+        """Upper bound in ms of the bucket the pth percentile falls in"""
+        target, seen = self.count * p, 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= target:
+                return BUCKETS[i] if i < len(BUCKETS) else float('inf')
+        return 0
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'bytes': self.bytes,
+            'seconds': self.seconds,
+            'p50_ms': self.percentile(0.5),
+            'p95_ms': self.percentile(0.95),
+            'buckets_ms': dict(zip(list(map(str, BUCKETS)) + ['inf'], self.buckets)),
+        }
+
+
+class Timer(object):
+    """Times a with block, callers can set bytes and error on it"""
+    __slots__ = ('stats', 'key', 'bytes', 'error', 'start')
+
+    def __init__(self, stats, key):
+        self.stats = stats
+        self.key = key
+        self.bytes = 0
+        self.error = False
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stats.record(self.key, time.time() - self.start,
+                          self.bytes, self.error or exc_type is not None)
+
+
+class NullTimer(object):
+    """What timed() hands out while stats are disabled"""
+    __slots__ = ()
+    bytes = error = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def __setattr__(self, name, value):
+        pass
+
+
+_null_timer = NullTimer()
+
+
+class Stats(object):
+    """Call counts, latency histograms, bytes and errors per operation
+
+    Operations are keyed by a group, api, vlc or loop, and a name, usually
+    an endpoint family. Disabled stats hand out a shared no-op timer, so
+    instrumented code costs one attribute check.
+    """
+    def __init__(self, enabled=STATS_ENABLED):
+        self.enabled = enabled
+        self.started = time.time()
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def timed(self, group, name):
+        if not self.enabled:
+            return _null_timer
+        return Timer(self, (group, name))
+
+    def record(self, key, seconds, nbytes=0, error=False):
+        with self._lock:
+            metric = self._metrics.get(key)
+            if metric is None:
+                metric = self._metrics[key] = Metric()
+            metric.add(seconds, nbytes or 0, bool(error))
+
+    def to_dict(self):
+        with self._lock:
+            metrics = sorted(self._metrics.items())
+            return {
+                'uptime': time.time() - self.started,
+                'metrics': [dict(group=g, name=n, **m.to_dict()) for (g, n), m in metrics],
+            }
+
+    def report(self):
+        """The metrics as a table, slowest in total first"""
+        if not self.enabled:
+            return 'stats are disabled, set "stats": true in config.json\n'
+        with self._lock:
+            metrics = sorted(self._metrics.items(), key=lambda x: -x[1].seconds)
+            lines = [u"{:<5} {:<40} {:>7} {:>6} {:>9} {:>8} {:>8} {:>10}".format(
+                'group', 'name', 'count', 'err%', 'total s', 'p50 ms', 'p95 ms', 'bytes')]
+            for (group, name), m in metrics:
+                lines.append(u"{:<5} {:<40} {:>7} {:>6.1f} {:>9.2f} {:>8} {:>8} {:>10}".format(
+                    group, name[:40], m.count, 100.0 * m.errors / m.count,
+                    m.seconds, m.percentile(0.5), m.percentile(0.95), m.bytes))
+        return u"\n".join(lines) + "\n"
+
+    def dump(self, path=STATS_FILE):
+        """Atomically writes the metrics to path as json"""
+        directory = os.path.dirname(path)
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            f.write(simplejson.dumps(self.to_dict(), indent=2))
+        os.rename(tmp, path)
+
+    def install(self):
+        """Dumps the metrics on exit and whenever SIGUSR1 is received"""
+        if not self.enabled:
+            return
+        atexit.register(self.dump)
+        if hasattr(signal, 'SIGUSR1'):
+            signal.signal(signal.SIGUSR1, self._on_signal)
+
+    def _on_signal(self, signum, frame):
+        # the handler can interrupt the main thread while it holds _lock,
+        # so dump from another thread that can wait for it to be released
+        thread = threading.Thread(target=self.dump)
+        thread.daemon = True
+        thread.start()
+
+
+stats = Stats()
@@ -0,0 +1,444 @@
+import itertools
+import mmap
+import os
+import re
+import socket
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs, urlparse
+
+import requests
+
+from silverlining import (
+    AUDIO_CACHE_BYTES,
+    AUDIO_DIR,
+    PREFETCH_TRACKS,
+    PREFETCH_WARM_BYTES,
+)
+from silverlining.stats import stats
+from silverlining.transport import transport
+
+
+# resolved urls without an Expires param are assumed to be good for this long
+DEFAULT_URL_TTL = 5 * 60
+# re-resolve urls this many seconds before they expire
+EXPIRY_MARGIN = 30
+CHUNK_SIZE = 64 * 1024
+# partial downloads untouched for this long were left by a process that quit
+# mid-track
+STALE_PART = 60 * 60
+
+
+def url_expiry(url):
+    """Expiry time of a signed CDN url"""
+    query = parse_qs(urlparse(url).query)
+    try:
+        return int(query['Expires'][0])
+    except (KeyError, ValueError):
+        return time.time() + DEFAULT_URL_TTL
+
+
+class AudioCache(object):
+    """Size bounded store of fully downloaded tracks
+
+    Tracks are kept as one file each and evicted least recently played
+    first once the store grows past max_bytes.
+    """
+    def __init__(self, path=AUDIO_DIR, max_bytes=AUDIO_CACHE_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+
+    def _filename(self, track_id):
+        return os.path.join(self.path, '%s.mp3' % track_id)
+
+    def __contains__(self, track_id):
+        return os.path.isfile(self._filename(track_id))
+
+    def lookup(self, track_id):
+        """Returns the path of the cached track or None"""
+        filename = self._filename(track_id)
+        try:
+            os.utime(filename, None)
+        except OSError:
+            return None
+        return filename
+
+    def writer(self, track_id):
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        return CacheWriter(self, track_id)
+
+    def _evict(self):
+        """Removes stale partial downloads, then tracks until under max_bytes
+
+        Partial downloads still being written count towards max_bytes but
+        are never evicted.
+        """
+        if not os.path.isdir(self.path):
+            return
+        entries, size = [], 0
+        stale = time.time() - STALE_PART
+        for name in os.listdir(self.path):
+            filename = os.path.join(self.path, name)
+            try:
+                st = os.stat(filename)
+            except OSError:
+                continue
+            if name.endswith('.part'):
+                if st.st_mtime < stale:
+                    try:
+                        os.remove(filename)
+                        continue
+                    except OSError:
+                        pass
+                size += st.st_size
+            elif name.endswith('.mp3'):
+                entries.append((st.st_mtime, st.st_size, name))
+                size += st.st_size
+
+        for _, entry_size, name in sorted(entries):
+            if size <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.path, name))
+            except OSError:
+                continue
+            size -= entry_size
+
+
+class CacheWriter(object):
+    """Collects a track's bytes as they're streamed, adds them once complete"""
+    def __init__(self, cache, track_id):
+        self.cache = cache
+        self.track_id = track_id
+        fd, self.tmp = tempfile.mkstemp(dir=cache.path, suffix='.part')
+        self.f = os.fdopen(fd, 'wb')
+        self.size = 0
+
+    def write(self, data):
+        self.f.write(data)
+        self.size += len(data)
+
+    def commit(self, total=None):
+        """Adds the track to the cache if all total bytes were written"""
+        self.f.close()
+        if not self.size or (total is not None and self.size != total):
+            self.abort()
+            return
+        try:
+            os.rename(self.tmp, self.cache._filename(self.track_id))
+        except OSError:
+            # cleaned up as stale while playback was paused
+            return
+        self.cache._evict()
+
+    def abort(self):
+        self.f.close()
+        try:
+            os.remove(self.tmp)
+        except OSError:
+            pass
+
+
+class ResolvedStream(object):
+    """Where a track's stream redirects to, and optionally its first bytes"""
+    __slots__ = ('url', 'expires', 'head', 'total', 'content_type')
+
+    def __init__(self, url, expires):
+        self.url = url
+        self.expires = expires
+        self.head = None
+        self.total = None
+        self.content_type = 'audio/mpeg'
+
+    @property
+    def fresh(self):
+        return time.time() < self.expires - EXPIRY_MARGIN
+
+
+class Prefetcher(object):
+    """Resolves stream redirects for upcoming tracks in the background
+
+    The player hands it the ids of the next few tracks whenever the queue or
+    the current track changes. Their API stream urls are resolved to CDN
+    urls ahead of time and re-resolved before they expire, and if warm_bytes
+    is set the start of each stream is downloaded too.
+    """
+    def __init__(self, cache, warm_bytes=PREFETCH_WARM_BYTES):
+        self.cache = cache
+        self.warm_bytes = warm_bytes
+        # for the CDN only, API requests go through the transport
+        self.session = requests.Session()
+        self._uris = {}
+        self._resolved = {}
+        self._window = []
+        self._dirty = False
+        self._running = False
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def register(self, track_id, api_uri):
+        self._uris[track_id] = api_uri
+
+    def update(self, track_ids):
+        track_ids = list(track_ids)
+        with self._cond:
+            if track_ids == self._window:
+                return
+            self._window = track_ids
+            self._dirty = True
+            self._cond.notify()
+
+    def get(self, track_id):
+        """Returns a fresh ResolvedStream, resolving it now if need be"""
+        resolved = self._resolved.get(track_id)
+        if resolved is None or not resolved.fresh:
+            resolved = self._resolve(track_id)
+        return resolved
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+
+    def _resolve(self, track_id):
+        api_uri = self._uris[track_id]
+        # the API hands out the CDN url, so this goes through the transport
+        resp = transport.request('GET', api_uri, allow_redirects=False)
+        if resp.is_redirect:
+            url = resp.headers['Location']
+            resolved = ResolvedStream(url, url_expiry(url))
+        else:
+            resolved = ResolvedStream(api_uri, time.time() + DEFAULT_URL_TTL)
+        self._resolved[track_id] = resolved
+        return resolved
+
+    def _warm(self, resolved):
+        with stats.timed('cdn', 'warm') as timer:
+            resp = self.session.get(resolved.url, headers={
+                'Range': 'bytes=0-%d' % (self.warm_bytes - 1)})
+            timer.bytes = len(resp.content)
+        match = re.match(r'bytes \d+-\d+/(\d+)', resp.headers.get('Content-Range', ''))
+        if resp.status_code != 206 or not match:
+            # no range support, VLC will just have to fetch it itself
+            resolved.total = 0
+            return
+        resolved.total = int(match.group(1))
+        resolved.content_type = resp.headers.get('Content-Type', resolved.content_type)
+        resolved.head = resp.content
+
+    def _run(self):
+        while self._running:
+            with self._cond:
+                window = list(self._window)
+                self._dirty = False
+
+            for track_id in window:
+                if track_id in self.cache:
+                    continue
+                try:
+                    resolved = self._resolved.get(track_id)
+                    if resolved is None or not resolved.fresh:
+                        resolved = self._resolve(track_id)
+                    if self.warm_bytes and resolved.total is None:
+                        self._warm(resolved)
+                except (KeyError, requests.exceptions.RequestException):
+                    continue
+
+            # only hold on to audio for tracks that are coming up
+            for track_id, resolved in list(self._resolved.items()):
+                if track_id not in window:
+                    resolved.head = resolved.total = None
+
+            expiries = [self._resolved[i].expires for i in window if i in self._resolved]
+            with self._cond:
+                if self._running and not self._dirty:
+                    timeout = None
+                    if expiries:
+                        timeout = max(min(expiries) - EXPIRY_MARGIN - time.time(), 1)
+                    self._cond.wait(timeout)
+
+
+class StreamHandler(BaseHTTPRequestHandler):
+    """Local caching proxy VLC streams tracks through
+
+    Cached tracks are served from memory mapped files, with Range support
+    so seeking works. Anything else is streamed through from the CDN,
+    starting with the prefetched bytes if there are any, and teed into the
+    audio cache. Seeks within a track that isn't cached yet are redirected
+    to the CDN.
+    """
+    def do_GET(self):
+        match = re.match(r'^/stream/(\d+)$', self.path)
+        if not match:
+            self.send_error(404)
+            return
+        track_id = int(match.group(1))
+
+        filename = self.server.cache.lookup(track_id)
+        if filename:
+            self._serve_file(filename)
+            return
+
+        try:
+            resolved = self.server.prefetcher.get(track_id)
+        except KeyError:
+            self.send_error(404)
+            return
+        except requests.exceptions.RequestException:
+            self.send_error(502)
+            return
+
+        if 'Range' in self.headers:
+            self.send_response(302)
+            self.send_header('Location', resolved.url)
+            self.end_headers()
+            return
+        self._proxy(track_id, resolved)
+
+    def _serve_file(self, filename):
+        with open(filename, 'rb') as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            size = len(data)
+            start, end = 0, size - 1
+            match = re.match(r'bytes=(\d*)-(\d*)', self.headers.get('Range', ''))
+            if match and (match.group(1) or match.group(2)):
+                if not match.group(1):
+                    # suffix range, the last n bytes
+                    start = max(size - int(match.group(2)), 0)
+                else:
+                    start = int(match.group(1))
+                    if match.group(2):
+                        end = min(int(match.group(2)), size - 1)
+                if start > end:
+                    self.send_response(416)
+                    self.send_header('Content-Range', 'bytes */%d' % size)
+                    self.end_headers()
+                    return
+                self.send_response(206)
+                self.send_header('Content-Range', 'bytes %d-%d/%d' % (start, end, size))
+            else:
+                self.send_response(200)
+            self.send_header('Content-Type', 'audio/mpeg')
+            self.send_header('Content-Length', str(end - start + 1))
+            self.send_header('Accept-Ranges', 'bytes')
+            self.end_headers()
+            for offset in range(start, end + 1, CHUNK_SIZE):
+                self.wfile.write(data[offset:min(offset + CHUNK_SIZE, end + 1)])
+        except socket.error:
+            pass
+        finally:
+            data.close()
+
+    def _proxy(self, track_id, resolved):
+        session = self.server.prefetcher.session
+        head, total = resolved.head, resolved.total
+        rest = []
+        if head is not None and total and len(head) < total:
+            resp = session.get(resolved.url, stream=True, headers={
+                'Range': 'bytes=%d-' % len(head)})
+            match = re.match(r'bytes (\d+)-', resp.headers.get('Content-Range', ''))
+            if resp.status_code == 206 and match and int(match.group(1)) == len(head):
+                rest = resp.iter_content(CHUNK_SIZE)
+            else:
+                # anything but the rest of the stream would corrupt the audio,
+                # so forget the prefetched bytes and start over
+                resp.close()
+                head = resolved.head = resolved.total = None
+
+        if head is not None and total:
+            chunks = itertools.chain([head], rest)
+            content_type = resolved.content_type
+        else:
+            resp = session.get(resolved.url, stream=True)
+            if resp.status_code != 200:
+                self.send_error(502)
+                return
+            total = int(resp.headers.get('Content-Length', 0)) or None
+            chunks = resp.iter_content(CHUNK_SIZE)
+            content_type = resp.headers.get('Content-Type', resolved.content_type)
+
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        if total:
+            self.send_header('Content-Length', str(total))
+        self.end_headers()
+
+        writer = self.server.cache.writer(track_id)
+        try:
+            for chunk in chunks:
+                self.wfile.write(chunk)
+                writer.write(chunk)
+        except (socket.error, requests.exceptions.RequestException):
+            # VLC hung up or the CDN did, VLC will retry with a Range request
+            writer.abort()
+        else:
+            writer.commit(total)
+
+    def log_message(self, *args):
+        pass
+
+
+class StreamServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, prefetcher):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), StreamHandler)
+        self.prefetcher = prefetcher
+        self.cache = prefetcher.cache
+
+    def uri(self, track_id):
+        return 'http://127.0.0.1:%s/stream/%s' % (self.server_port, track_id)
+
+
+_server = None
+
+
+def start():
+    """Starts the local stream server and prefetcher"""
+    global _server
+    if _server:
+        return
+    cache = AudioCache()
+    # clear out what was left by the last run
+    cache._evict()
+    prefetcher = Prefetcher(cache)
+    prefetcher.start()
+    _server = StreamServer(prefetcher)
+    thread = threading.Thread(target=_server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+
+def stop():
+    global _server
+    if not _server:
+        return
+    _server.prefetcher.stop()
+    _server.shutdown()
+    _server.server_close()
+    _server = None
+
+
+def local_uri(track):
+    """URI for VLC to play track through the stream server, if it's running"""
+    if not _server:
+        return None
+    _server.prefetcher.register(track.id, track.api_stream_uri)
+    return _server.uri(track.id)
+
+
+def prefetch(track_ids):
+    """Sets the tracks to resolve ahead of time"""
+    if _server:
+        _server.prefetcher.update(track_ids[:PREFETCH_TRACKS])
@@ -0,0 +1,126 @@
+import os
+import tempfile
+import time
+from urllib.parse import parse_qs, urlparse
+
+import simplejson
+
+from silverlining import STREAMS_DIR
+
+
+# don't go back to the API for new items more often than this
+MIN_REFRESH = 60
+# most items kept on disk per stream, older ones are dropped
+MAX_ITEMS = 2000
+
+
+class Timeline(object):
+    """Activity stream persisted on disk and refreshed incrementally
+
+    A refresh fetches only the items newer than the ones stored, from the
+    future_href cursor the API handed out last time. Streams without one
+    fetch their first page and keep what comes before the newest stored
+    item. Older items are paged in from next_href only when they're asked
+    for.
+
+    fetch(url) returns a page of the stream as json, extract(item) returns
+    the track dict to store for an activity or None to skip it.
+    """
+    def __init__(self, name, url, fetch, extract):
+        self.path = os.path.join(STREAMS_DIR, name + '.json')
+        self.url = url
+        self.fetch = fetch
+        self.extract = extract
+        self._state = None
+
+    @property
+    def state(self):
+        if self._state is None:
+            try:
+                with open(self.path, 'rb') as f:
+                    self._state = simplejson.loads(f.read())
+            except (IOError, ValueError):
+                self._state = {'items': [], 'future_href': None,
+                               'next_href': None, 'refreshed': 0}
+        return self._state
+
+    def _save(self):
+        if not os.path.isdir(STREAMS_DIR):
+            os.makedirs(STREAMS_DIR)
+        fd, tmp = tempfile.mkstemp(dir=STREAMS_DIR, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            f.write(simplejson.dumps(self.state))
+        os.rename(tmp, self.path)
+
+    def _entries(self, page):
+        entries = []
+        for item in page.get('collection', []):
+            track = self.extract(item)
+            if track:
+                key = '%s:%s:%s' % (item.get('type'), track['id'], item.get('created_at'))
+                entries.append({'key': key, 'track': track})
+        return entries
+
+    def refresh(self):
+        """Fetches items newer than the stored ones"""
+        state = self.state
+        if time.time() - state['refreshed'] < MIN_REFRESH:
+            return
+
+        if state['items'] and state['future_href']:
+            page = self.fetch(state['future_href'])
+            new = self._entries(page)
+            # a full page may not reach back to what's stored
+            overlaps = len(page.get('collection', [])) < page_limit(state['future_href'])
+        else:
+            page = self.fetch(self.url)
+            new = self._entries(page)
+            known = set(entry['key'] for entry in state['items'])
+            overlaps = False
+            for i, entry in enumerate(new):
+                if entry['key'] in known:
+                    new, overlaps = new[:i], True
+                    break
+
+        if overlaps:
+            state['items'] = new + state['items']
+        else:
+            state['items'] = new
+            state['next_href'] = page.get('next_href')
+        if len(state['items']) > MAX_ITEMS:
+            del state['items'][MAX_ITEMS:]
+            state['next_href'] = None
+
+        state['future_href'] = page.get('future_href') or state['future_href']
+        state['refreshed'] = time.time()
+        self._save()
+
+    def tracks(self):
+        """Yields stored track dicts newest first, then pages back for more"""
+        self.refresh()
+        i = 0
+        while True:
+            items = self.state['items']
+            if i < len(items):
+                yield items[i]['track']
+                i += 1
+                continue
+
+            next_href = self.state['next_href']
+            if not next_href or len(items) >= MAX_ITEMS:
+                return
+            page = self.fetch(next_href)
+            known = set(entry['key'] for entry in items)
+            items.extend(e for e in self._entries(page) if e['key'] not in known)
+            if page.get('next_href') == next_href:
+                page['next_href'] = None
+            self.state['next_href'] = page.get('next_href')
+            self._save()
+
+
+def page_limit(url, default=50):
+    """The limit param of a paging url"""
+    try:
+        return int(parse_qs(urlparse(url).query)['limit'][0])
+    except (KeyError, ValueError):
+        return default
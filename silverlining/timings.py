@@ -0,0 +1,60 @@
+import sys
+import time
+
+
+# seconds from importing silverlining to a command getting under way
+STARTUP_BUDGET = 0.15
+
+
+class Phase(object):
+    __slots__ = ('timings', 'name', 'start')
+
+    def __init__(self, timings, name):
+        self.timings = timings
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *args):
+        if self.timings.enabled:
+            self.timings.phases.append((self.name, self.start, time.time() - self.start))
+
+
+class Timings(object):
+    """Wall time of the phases of a run, reported by --timings
+
+    Startup is the time from importing the package to the command being
+    ready to run: config, imports, parsing and handing off to a daemon.
+    It's checked against STARTUP_BUDGET.
+    """
+    def __init__(self):
+        self.enabled = False
+        self.started = time.time()
+        self.ready_at = None
+        self.phases = []
+
+    def phase(self, name):
+        return Phase(self, name)
+
+    def ready(self):
+        """Marks the end of startup"""
+        if self.ready_at is None:
+            self.ready_at = time.time()
+
+    def report(self, out=None):
+        out = out or sys.stderr
+        out.write("\ntimings:\n")
+        for name, start, duration in self.phases:
+            out.write("  {:<24} +{:>8.1f}ms {:>8.1f}ms\n".format(
+                name, 1000 * (start - self.started), 1000 * duration))
+        if self.ready_at is not None:
+            startup = self.ready_at - self.started
+            out.write("  startup {:.1f}ms, budget {:.0f}ms{}\n".format(
+                1000 * startup, 1000 * STARTUP_BUDGET,
+                ', OVER BUDGET' if startup > STARTUP_BUDGET else ''))
+        out.write("  total {:.1f}ms\n".format(1000 * (time.time() - self.started)))
+
+
+timings = Timings()
@@ -0,0 +1,129 @@
+import random
+import threading
+import time
+from concurrent.futures import Future
+
+import requests
+import simplejson
+from requests.adapters import HTTPAdapter
+
+from silverlining import (
+    API_BURST,
+    API_REQUESTS_PER_SECOND,
+)
+from silverlining.stats import (
+    endpoint_family,
+    stats,
+)
+from silverlining.utils import TokenBucket
+
+
+# connections kept open per host
+POOL_SIZE = 8
+# seconds to wait for a connection and then for a response
+TIMEOUT = (5, 30)
+MAX_RETRIES = 4
+BACKOFF_BASE = 0.5
+MAX_BACKOFF = 30
+RETRY_STATUSES = frozenset([429, 500, 502, 503, 504])
+# safe to send again after a 5xx or a dropped connection
+IDEMPOTENT = frozenset(['GET', 'HEAD', 'PUT', 'DELETE'])
+
+
+def retry_after(resp):
+    """Seconds the server asked us to wait, or None"""
+    try:
+        return max(0.0, float(resp.headers['Retry-After']))
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def backoff(attempt, resp=None):
+    """Retry-After if the server sent one, else full jittered exponential backoff"""
+    wait = retry_after(resp) if resp is not None else None
+    if wait is None:
+        wait = random.uniform(0, BACKOFF_BASE * 2 ** attempt)
+    return min(wait, MAX_BACKOFF)
+
+
+class SingleFlight(object):
+    """Runs one call per key at a time, concurrent callers share its result"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, func):
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+        if not leader:
+            return future.result()
+
+        try:
+            result = func()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+
+class Transport(object):
+    """The one way requests reach SoundCloud
+
+    Requests share a pooled keep-alive session, so TLS is only negotiated
+    once per connection, and are paced by a token bucket of rate requests
+    a second with bursts of up to burst. 429s, and 5xx or dropped
+    connections for idempotent methods, are retried with jittered
+    exponential backoff. Identical GETs in flight at the same time are
+    sent once and every caller gets the same response.
+    """
+    def __init__(self, rate=API_REQUESTS_PER_SECOND, burst=API_BURST):
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.bucket = TokenBucket(rate, burst)
+        self._inflight = SingleFlight()
+
+    def get(self, url, params=None, headers=None):
+        key = simplejson.dumps([url, params, headers], sort_keys=True)
+        return self._inflight.do(key, lambda: self.request(
+            'GET', url, params=params, headers=headers))
+
+    def request(self, method, url, **kwargs):
+        """Sends the request, retrying as needed, returns the last response
+
+        Raises if the connection still fails after the last retry; error
+        statuses are left to the caller.
+        """
+        method = method.upper()
+        name = '%s %s' % (method, endpoint_family(url))
+        kwargs.setdefault('timeout', TIMEOUT)
+        for attempt in range(MAX_RETRIES + 1):
+            self.bucket.take()
+            resp = None
+            try:
+                with stats.timed('api', name) as timer:
+                    resp = self.session.request(method, url, **kwargs)
+                    timer.bytes = len(resp.content)
+                    timer.error = resp.status_code >= 400
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                if attempt == MAX_RETRIES or method not in IDEMPOTENT:
+                    raise
+            else:
+                if resp.status_code not in RETRY_STATUSES or attempt == MAX_RETRIES:
+                    return resp
+                # a 429 was never acted on, anything else only if it's safe to repeat
+                if resp.status_code != 429 and method not in IDEMPOTENT:
+                    return resp
+            time.sleep(backoff(attempt, resp))
+
+
+transport = Transport()
@@ -1,11 +1,15 @@
 import collections
+import collections.abc
+import itertools
+import random
+import re
 import signal
 import sys
 import termios
+import threading
+import time
 import tty
 
-from fuzzywuzzy import process
-
 
 class TimeoutError(Exception):
     pass
@@ -58,17 +62,353 @@ def timestamp(time_pos, length):
     return "({}/{})".format(sec_to_str(time_pos), sec_to_str(length))
 
 
-def search_collection(items, query, key='title'):
+def search_collection(items, query, limit=5):
     """Levenstein fuzzy search"""
-    d = {i[key]: i for i in items}
-    bests = process.extractBests(query, list(d.keys()))
-    if bests:
-        return [d[match[0]] for match in bests]
-    else:
-        return []
+    return SearchIndex(items).search(query, limit)
+
+
+def item_key(item):
+    """Identity of an API object, so equal titles don't collide"""
+    return item.kind, item.id
+
+
+def trigrams(text):
+    grams = set()
+    for word in re.sub(r'\W+', ' ', text.lower(), flags=re.UNICODE).split():
+        word = ' %s ' % word
+        grams.update(word[i:i + 3] for i in range(len(word) - 2))
+    return grams
+
+
+def words(text):
+    return re.findall(r'\w+', text, re.UNICODE)
+
+
+class PrefixTrie(object):
+    """Words by case-insensitive prefix, for tab completion
+
+    Words are counted, so a word added by several items stays until the
+    last of them removes it. Completions are found shortest first and only
+    as many as asked for are walked, however many words are stored.
+    """
+    def __init__(self, words=()):
+        self._root = {}
+        for word in words:
+            self.add(word)
+
+    def add(self, word):
+        node = self._root
+        for ch in word.lower():
+            node = node.setdefault(ch, {})
+        # '' can't clash with a character key
+        entry = node.setdefault('', [word, 0])
+        entry[1] += 1
+
+    def remove(self, word):
+        key = word.lower()
+        path = [self._root]
+        for ch in key:
+            node = path[-1].get(ch)
+            if node is None:
+                return
+            path.append(node)
+        entry = path[-1].get('')
+        if entry is None:
+            return
+        entry[1] -= 1
+        if entry[1] > 0:
+            return
+        del path[-1]['']
+        # prune the branch back to the last node still in use
+        for i in range(len(key), 0, -1):
+            if path[i]:
+                break
+            del path[i - 1][key[i - 1]]
+
+    def clear(self):
+        self._root = {}
+
+    def complete(self, prefix, limit=50):
+        """Up to limit stored words starting with prefix, shortest first"""
+        node = self._root
+        for ch in prefix.lower():
+            node = node.get(ch)
+            if node is None:
+                return []
+        found = []
+        queue = collections.deque([node])
+        while queue and len(found) < limit:
+            node = queue.popleft()
+            for ch, child in node.items():
+                if ch == '':
+                    found.append(child[0])
+                else:
+                    queue.append(child)
+        return found[:limit]
+
+
+class SearchIndex(object):
+    """Trigram index over titles, usernames and tags for fuzzy searching
+
+    Only items sharing the most trigrams with the query are fuzzy scored, so
+    a search costs about the same no matter how many items are indexed.
+    Items can be added and removed as the collection they mirror changes.
+    The words in them are kept in a PrefixTrie for completion.
+    """
+    max_candidates = 50
+
+    def __init__(self, items=()):
+        self._items = {}
+        self._grams = collections.defaultdict(set)
+        self._words = PrefixTrie()
+        self._seq = itertools.count()
+        for item in items:
+            self.add(item)
+
+    def __len__(self):
+        return len(self._items)
+
+    def _text(self, item):
+        fields = ('title', 'username', 'tag_list')
+        return u' '.join(filter(None, (getattr(item, f, None) for f in fields)))
+
+    def add(self, item):
+        key = item_key(item)
+        if key in self._items:
+            self.remove(item)
+        text = self._text(item)
+        grams = trigrams(text)
+        self._items[key] = (next(self._seq), item, text, grams)
+        for gram in grams:
+            self._grams[gram].add(key)
+        for word in words(text):
+            self._words.add(word)
+
+    def remove(self, item):
+        try:
+            _, _, text, grams = self._items.pop(item_key(item))
+        except KeyError:
+            return
+        for word in words(text):
+            self._words.remove(word)
+        for gram in grams:
+            keys = self._grams[gram]
+            keys.discard(item_key(item))
+            if not keys:
+                del self._grams[gram]
+
+    def clear(self):
+        self._items.clear()
+        self._grams.clear()
+        self._words.clear()
+
+    def complete(self, prefix, limit=50):
+        """Words in the indexed items starting with prefix"""
+        return self._words.complete(prefix, limit)
+
+    def search(self, query, limit=5):
+        """Returns up to limit items best matching query, best first"""
+        # fuzzywuzzy is slow to import and only needed once there's a search
+        from fuzzywuzzy import fuzz
+
+        hits = collections.Counter()
+        for gram in trigrams(query):
+            hits.update(self._grams.get(gram, ()))
+
+        scored = []
+        for key, _ in hits.most_common(self.max_candidates):
+            seq, item, text, _ = self._items[key]
+            scored.append((-fuzz.WRatio(query, text), seq, item))
+        scored.sort(key=lambda x: x[:2])
+        return [item for _, _, item in scored[:limit]]
+
+
+class RequestBudget(object):
+    """Allows at most limit requests in any period seconds"""
+    def __init__(self, limit, period):
+        self.limit = limit
+        self.period = period
+        self._times = collections.deque()
+
+    def take(self):
+        """Uses up one request if any are left, returns whether it could"""
+        now = time.time()
+        while self._times and self._times[0] <= now - self.period:
+            self._times.popleft()
+        if len(self._times) >= self.limit:
+            return False
+        self._times.append(now)
+        return True
+
+
+class TokenBucket(object):
+    """Allows rate requests a second on average, in bursts of up to burst"""
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.time()
+        self._lock = threading.Lock()
+
+    def take(self):
+        """Uses up one token, waiting until there is one"""
+        while True:
+            with self._lock:
+                now = time.time()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class _Node(object):
+    __slots__ = ('item', 'priority', 'size', 'left', 'right', 'parent')
+
+    def __init__(self, item):
+        self.item = item
+        self.priority = random.random()
+        self.size = 1
+        self.left = self.right = self.parent = None
+
+
+def _size(node):
+    return node.size if node else 0
+
+
+def _update(node):
+    node.size = 1 + _size(node.left) + _size(node.right)
+    if node.left:
+        node.left.parent = node
+    if node.right:
+        node.right.parent = node
+
+
+def _merge(a, b):
+    if not a or not b:
+        return a or b
+    if a.priority > b.priority:
+        a.right = _merge(a.right, b)
+        _update(a)
+        return a
+    b.left = _merge(a, b.left)
+    _update(b)
+    return b
+
+
+def _split(node, k):
+    """Splits off the first k nodes"""
+    if not node:
+        return None, None
+    if _size(node.left) >= k:
+        left, node.left = _split(node.left, k)
+        _update(node)
+        return left, node
+    node.right, right = _split(node.right, k - _size(node.left) - 1)
+    _update(node)
+    return node, right
+
+
+class IndexedList(object):
+    """List of unique hashable items with O(log n) positional operations
+
+    Backed by an implicit treap, so looking up, inserting, removing or
+    moving an item by position, and finding an item's position, don't
+    shift or rescan the rest of the list.
+    """
+    def __init__(self, iterable=()):
+        self._root = None
+        self._nodes = {}
+        for item in iterable:
+            self.append(item)
+
+    def __len__(self):
+        return _size(self._root)
+
+    def __contains__(self, item):
+        return item in self._nodes
+
+    def __iter__(self):
+        stack, node = [], self._root
+        while stack or node:
+            while node:
+                stack.append(node)
+                node = node.left
+            node = stack.pop()
+            yield node.item
+            node = node.right
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('list index out of range')
+        node = self._root
+        while True:
+            left = _size(node.left)
+            if i < left:
+                node = node.left
+            elif i == left:
+                return node.item
+            else:
+                i -= left + 1
+                node = node.right
+
+    def _set_root(self, root):
+        if root:
+            root.parent = None
+        self._root = root
+
+    def index(self, item):
+        try:
+            node = self._nodes[item]
+        except KeyError:
+            raise ValueError('%r is not in list' % (item,))
+        i = _size(node.left)
+        while node.parent:
+            if node is node.parent.right:
+                i += _size(node.parent.left) + 1
+            node = node.parent
+        return i
+
+    def insert(self, i, item):
+        if item in self._nodes:
+            raise ValueError('%r is already in list' % (item,))
+        node = self._nodes[item] = _Node(item)
+        left, right = _split(self._root, max(0, min(i, len(self))))
+        self._set_root(_merge(_merge(left, node), right))
+
+    def append(self, item):
+        self.insert(len(self), item)
+
+    def pop(self, i=-1):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('pop index out of range')
+        left, rest = _split(self._root, i)
+        node, right = _split(rest, 1)
+        del self._nodes[node.item]
+        self._set_root(_merge(left, right))
+        return node.item
+
+    def remove(self, item):
+        self.pop(self.index(item))
+
+    def move(self, item, i):
+        self.remove(item)
+        self.insert(i, item)
+
+    def clear(self):
+        self._root = None
+        self._nodes.clear()
 
 
-class OrderedSet(collections.MutableSet):
+class OrderedSet(collections.abc.MutableSet):
     """http://code.activestate.com/recipes/576694/"""
     def __init__(self, iterable=None):
         self.end = end = []
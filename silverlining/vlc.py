@@ -1,66 +1,125 @@
 import functools
-import simplejson
+import os
 import subprocess
 import sys
+import tempfile
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from queue import Empty, Queue
+from xml.sax.saxutils import escape
 
 import requests
 
 from silverlining import (
-    HIST_FILE,
-    client,
+    VLC_COMMAND,
+    VLC_URL,
+    stream,
     utils,
 )
 from silverlining.command import CommandMode
-from silverlining.models import get_silverlining_playlist
+from silverlining.history import History
+from silverlining.models import silverlining_playlist
+from silverlining.radio import Radio
+from silverlining.stats import stats
 
 
 HOTKEYS = {}
-MAX_HIST = 50
+# how long to wait for VLC to list enqueued tracks before giving up on them
+ENQUEUE_TIMEOUT = 10
+# batches at least this big are handed to VLC as a single playlist file
+BULK_THRESHOLD = 10
+# Status polling intervals. VLC is polled slowly while a track plays steadily
+# and quickly near the end of a track and for a while after user input.
+POLL_FAST = 0.25
+POLL_SLOW = 5
+FAST_POLL_PERIOD = 2
+BOUNDARY_WINDOW = 2
+# threads running background hotkey actions
+HOTKEY_WORKERS = 4
+
+
+def write_xspf(tracks):
+    """Writes tracks to a temporary XSPF playlist, returns its path
+
+    Each item is titled with its track id, same as in_enqueue's name.
+    """
+    fd, path = tempfile.mkstemp(prefix='silverlining-', suffix='.xspf')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(b'<?xml version="1.0" encoding="UTF-8"?>\n'
+                b'<playlist version="1" xmlns="http://xspf.org/ns/0/">\n'
+                b'<trackList>\n')
+        for track in tracks:
+            f.write(u'<track><location>{}</location><title>{}</title></track>\n'.format(
+                escape(track.stream_uri), track['id']).encode('utf-8'))
+        f.write(b'</trackList>\n</playlist>\n')
+    return path
+
 
+def hotkey(keys, background=False, resource=None, **kwargs):
+    """Binds func to keys
 
-def hotkey(keys, **kwargs):
+    Background hotkeys run on a worker thread so they don't hold up the UI.
+    Those touching the same resource run one at a time.
+    """
     def decorator(func):
         for key in keys:
-            HOTKEYS[key] = functools.partial(func, **kwargs)
+            action = functools.partial(func, **kwargs)
+            action.background = background
+            action.resource = resource
+            HOTKEYS[key] = action
         return func
     return decorator
 
 
+def holds_queue_lock(func):
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        with self._queue_lock:
+            return func(self, *args, **kwargs)
+    return wrapper
+
+
 class Player(object):
-    _base_url = 'http://localhost:8080/requests/'
+    _base_url = VLC_URL
     _session = requests.session()
     _session.auth = requests.auth.HTTPBasicAuth('', 'silverlining')
-    _tracks = {}
     current_track = None
     _time = 0
     _length = 0
+    _state = None
+    _sampled_at = 0
+    _next_poll = 0
+    _fast_until = 0
     _running = False
     _cmd_mode = False
     _proc = None
-    _history = []
-
-    def __init__(self, no_input=False):
-        try:
-            with open(HIST_FILE, 'rb') as f:
-                self._history = simplejson.loads(f.read())
-                self._history.reverse()
-        except (IOError, simplejson.scanner.JSONDecodeError):
-            pass
 
+    def __init__(self, no_input=False, radio=False):
+        self._tracks = {}
+        self.history = History()
+        self._index = utils.SearchIndex()
+        self._queue = utils.IndexedList()
+        self._queue_lock = threading.RLock()
+        self._locks = {'queue': self._queue_lock}
+        self._workers = ThreadPoolExecutor(HOTKEY_WORKERS)
+        self._messages = Queue()
+        self._wakeup = threading.Event()
         self.no_input = no_input
         if not self.no_input:
             self.command_mode = CommandMode(self)
 
-        self.playlist = get_silverlining_playlist()
+        self.playlist = silverlining_playlist
+        self.radio = Radio(self)
+        self.radio.enabled = radio
 
     def __enter__(self):
         """Starts the VLC server and waits for it to start up before returning"""
         if self._proc:
             raise Exception("There's already a VLC process")
 
-        self._proc = subprocess.Popen([
-            "/Applications/VLC.app/Contents/MacOS/VLC",
+        stream.start()
+        self._proc = subprocess.Popen(VLC_COMMAND + [
             "--quiet", "--intf", "http", "--http-password", "silverlining",
         ], stdout=subprocess.PIPE, stdin=subprocess.PIPE, stderr=subprocess.PIPE, shell=False)
 
@@ -73,18 +132,14 @@ class Player(object):
 
     def __exit__(self, *args):
         """Terminates the VLC process on exit"""
+        self._workers.shutdown(wait=True)
         self._proc.terminate()
-        history = list(utils.OrderedSet(
-            [simplejson.dumps(item, indent=2) for item in reversed(self._history)]
-        ))[:MAX_HIST]
-
-        with open(HIST_FILE, 'w') as f:
-            f.write("[\n")
-            [f.write(item + ',\n') for item in history[:len(history) - 1]]
-            f.write(history[len(history) - 1] + '\n]\n')
+        stream.stop()
+        self.history.close()
+        self.playlist.close()
 
     def _write_track_to_history(self, track):
-        self._history.append({
+        self.history.append({
             'id': track['id'],
             'title': track['title'],
             'permalink_url': track['permalink_url'],
@@ -96,35 +151,162 @@ class Player(object):
         """Runs the poor man's thread"""
         self._running = True
         self.play()
+        self._poll_soon()
         while self._running:
-            self._update_status()
+            if time.time() >= self._next_poll:
+                with stats.timed('loop', 'poll'):
+                    self._update_status()
+                    self._next_poll = time.time() + self._poll_interval()
+                    self.radio.check()
+
+            wait = max(self._next_poll - time.time(), 0)
             if self.no_input:
+                # woken early by _poll_soon, e.g. when the daemon enqueues
+                self._wakeup.wait(wait)
+                self._wakeup.clear()
                 continue
 
-            keypress = utils.getch(1)
+            # redraw the locally interpolated clock at least once a second
+            keypress = utils.getch(min(max(wait, 0.05), 1))
             if keypress in HOTKEYS:
-                output = HOTKEYS[keypress](self)
-                if output:
-                    sys.stdout.write(u'\r{:120}\n'.format(output))
+                action = HOTKEYS[keypress]
+                with stats.timed('loop', 'hotkey ' + action.func.__name__):
+                    self._dispatch(action)
+                self._poll_soon()
+
+            while True:
+                try:
+                    output = self._messages.get_nowait()
+                except Empty:
+                    break
+                sys.stdout.write(u'\r{:120}\n'.format(output))
 
             sys.stdout.write(u'\r{:120}'.format(self.now_playing))
 
+    def _dispatch(self, action):
+        """Runs a hotkey action, in the background if it's marked as such"""
+        if not action.background:
+            self._notify(action(self))
+            return
+
+        lock = None
+        if action.resource:
+            lock = self._locks.setdefault(action.resource, threading.RLock())
+        self._workers.submit(self._run_action, action, lock)
+
+    def _run_action(self, action, lock):
+        try:
+            if lock:
+                with lock:
+                    output = action(self)
+            else:
+                output = action(self)
+        except Exception as e:
+            output = u"%s failed: %s" % (action.func.__name__, e)
+        self._notify(output)
+        self._poll_soon()
+
+    def _notify(self, output):
+        """Queues a message for the status line"""
+        if output and not self.no_input:
+            self._messages.put(output)
+
+    def _poll_soon(self):
+        """Polls VLC right away and frequently for a little while"""
+        self._next_poll = 0
+        self._fast_until = time.time() + FAST_POLL_PERIOD
+        self._wakeup.set()
+
+    def _poll_interval(self):
+        """Seconds until VLC's status should be checked again"""
+        if time.time() < self._fast_until:
+            return POLL_FAST
+        if self._state != 'playing':
+            return POLL_SLOW
+        if not self._length:
+            # still buffering
+            return POLL_FAST
+        remaining = self._length - self.elapsed
+        if remaining <= BOUNDARY_WINDOW:
+            return POLL_FAST
+        return min(POLL_SLOW, remaining - BOUNDARY_WINDOW)
+
     def get(self, endpoint, **kwargs):
         """Wrapper for http requests to VLC API"""
-        return self._session.get(self._base_url + endpoint, params=kwargs, verify=False)
-
+        name = endpoint
+        if 'command' in kwargs:
+            name += ' ' + kwargs['command']
+        with stats.timed('vlc', name) as timer:
+            resp = self._session.get(self._base_url + endpoint, params=kwargs, verify=False)
+            timer.bytes = len(resp.content)
+            timer.error = resp.status_code >= 400
+        return resp
+
+    @holds_queue_lock
     def load_tracks(self, tracks):
+        """Enqueues tracks, returns the ones VLC didn't pick up in time"""
+        added = []
         for track in list(tracks):
             if track['id'] in self._tracks:
                 continue
-            self.get('status.json', command='in_enqueue', input=track.stream_uri,
-                     name=track['id'])
             self._tracks[int(track['id'])] = track
+            self._index.add(track)
+            added.append(track)
 
-        # wait 2s for vlc's playlist to update
-        time.sleep(2)
-        self._sync_queue()
+        if len(added) >= BULK_THRESHOLD:
+            path = write_xspf(added)
+            try:
+                self.get('status.json', command='in_enqueue', input='file://' + path)
+                items, missing = self._wait_for_tracks(int(t['id']) for t in added)
+            finally:
+                os.remove(path)
+        else:
+            for track in added:
+                self.get('status.json', command='in_enqueue', input=track.stream_uri,
+                         name=track['id'])
+            items, missing = self._wait_for_tracks(int(t['id']) for t in added)
+
+        failed = [t for t in added if int(t['id']) in missing]
+        for track in failed:
+            self._tracks.pop(int(track['id']))
+            self._index.remove(track)
+        self._sync_queue(items)
+        return failed
+
+    def _playlist_items(self):
+        """Returns VLC's playlist entries for our tracks, in play order
+
+        Nested nodes (e.g. a playlist file VLC hasn't flattened yet) are
+        walked, and entries not named with a track id are skipped.
+        """
+        def leaves(node):
+            for d in node.get('children', []):
+                if 'children' in d:
+                    for leaf in leaves(d):
+                        yield leaf
+                elif utils.isint(d['name']):
+                    yield d
+
+        resp = self.get('playlist.json').json()
+        return list(leaves(resp['children'][0]))
+
+    def _wait_for_tracks(self, track_ids, timeout=ENQUEUE_TIMEOUT):
+        """Polls VLC's playlist with backoff until it lists every track id
 
+        Returns the last playlist items seen and the ids still missing.
+        """
+        pending = set(track_ids)
+        deadline = time.time() + timeout
+        delay = 0.01
+        while True:
+            items = self._playlist_items()
+            pending.difference_update(int(d['name']) for d in items)
+            if not pending or time.time() > deadline:
+                return items, pending
+            time.sleep(delay)
+            delay = min(delay * 2, 0.25)
+
+    @holds_queue_lock
     def remove_track(self, track):
         self.get('status.json', command='pl_delete', id=track.plid)
         try:
@@ -137,17 +319,43 @@ class Player(object):
             self.play()
         else:
             self._tracks.pop(track['id'])
-        for idx in range(track.idx, len(self.queue)):
-            self.queue[idx].idx -= 1
+        self._index.remove(track)
+        if track in self._queue:
+            self._queue.remove(track)
+        self._prefetch()
 
-    def _sync_queue(self):
+    @holds_queue_lock
+    def _sync_queue(self, items=None):
         """Syncs queue with VLC"""
-        resp = self.get('playlist.json').json()
-        playlist = resp['children'][0]
-        for i, d in enumerate(playlist['children']):
+        if items is None:
+            items = self._playlist_items()
+        # one VLC entry per track, the one we already know if it's there
+        keep = {}
+        for d in items:
+            track = self._tracks.get(int(d['name']))
+            if track is not None and (track['id'] not in keep or
+                                      int(d['id']) == getattr(track, 'plid', None)):
+                keep[track['id']] = d['id']
+        known = []
+        for d in items:
+            if keep.get(int(d['name'])) == d['id']:
+                known.append(d)
+            else:
+                # a track load_tracks gave up on turned up late, or twice
+                self.get('status.json', command='pl_delete', id=d['id'])
+        self._queue.clear()
+        for d in known:
             track = self._tracks[int(d['name'])]
-            track.idx = i
             track.plid = int(d['id'])
+            self._queue.append(track)
+        self._prefetch()
+
+    def _prefetch(self):
+        """Points the stream prefetcher at the tracks after the current one"""
+        start = 0
+        if self.current_track in self._queue:
+            start = self.current_idx + 1
+        stream.prefetch([t['id'] for t in self._queue[start:start + stream.PREFETCH_TRACKS]])
 
     def _update_track(self, vlc_id):
         if vlc_id is None and self.current_track is not None:
@@ -168,9 +376,20 @@ class Player(object):
 
         if self.current_track is None and vlc_id is not None:
             self.current_track = self._tracks[vlc_id]
+        self._prefetch()
 
     def _update_status(self):
         """updates current status"""
+        if not self._queue_lock.acquire(False):
+            # a background action is rearranging the queue, check back shortly
+            self._poll_soon()
+            return
+        try:
+            self._update_queue_status()
+        finally:
+            self._queue_lock.release()
+
+    def _update_queue_status(self):
         resp = self.get('status.json').json()
         try:
             vlc_id = int(resp['information']['category']['meta']['title'])
@@ -179,23 +398,38 @@ class Player(object):
         self._update_track(vlc_id)
         if self.current_track is None and self.num_tracks > 0:
             self.play()
+            self._poll_soon()
         self._length = resp['length']
         self._time = resp['time']
+        self._state = resp.get('state')
+        self._sampled_at = time.time()
 
     @property
     def queue(self):
-        return sorted(self._tracks.values(), key=lambda x: getattr(x, 'idx'))
+        """Tracks in play order, indexable in O(log n)"""
+        return self._queue
+
+    @property
+    def current_idx(self):
+        return self._queue.index(self.current_track)
 
     @property
     def num_tracks(self):
         return len(self._tracks)
 
+    @property
+    def elapsed(self):
+        """Playback position, interpolated from the last status sample"""
+        if self._state != 'playing':
+            return self._time
+        return min(self._time + time.time() - self._sampled_at, self._length)
+
     @property
     def now_playing(self):
         if self.current_track:
             return u"[%s] %s %s" % (
                 self.num_tracks,
-                utils.timestamp(self._time, self._length),
+                utils.timestamp(self.elapsed, self._length),
                 self.current_track,
             )
         else:
@@ -206,7 +440,7 @@ class Player(object):
             if utils.isint(target):
                 return self.queue[int(target)]
             else:
-                return utils.search_collection(self.queue, target)[0]
+                return self._index.search(target, limit=1)[0]
         except IndexError:
             return None
 
@@ -231,31 +465,30 @@ class Player(object):
         self.get('status.json', command='pl_next')
         return "Next..."
 
-    @hotkey('s')
+    @hotkey('s', background=True, resource='queue')
     def shuffle(self):
         self.get('status.json', command='pl_sort', id=0, val="random")
         self._sync_queue()
         return "Shuffling..."
 
     def _list_queue(self):
-        fmt = lambda x: "{:<12} {}".format(getattr(x, 'idx', 0), x)
-        return u'\n'.join(map(fmt, self.queue))
+        fmt = lambda x: u"{:<12} {}".format(*x)
+        return u'\n'.join(map(fmt, enumerate(self.queue)))
 
     def jump(self, track):
         self.get('status.json', command='pl_play', id=track.plid)
-        tracks = self.queue[:track.idx]
+        tracks = self.queue[:self.queue.index(track)]
         for track in tracks:
             self.remove_track(track)
 
     @hotkey('l')
     def list_queue(self):
-        fmt = lambda x: "{:<12} {}".format(getattr(x, 'idx', 0), x)
         output = u'\r'
         output += self._list_queue()
         output += u'\n'
         return output
 
-    @hotkey('u')
+    @hotkey('u', background=True)
     def display_url(self):
         if self.current_track:
             echo = subprocess.Popen(['echo', self.current_track['permalink_url']],
@@ -276,24 +509,29 @@ class Player(object):
     @hotkey('q')
     def quit(self):
         self._running = False
+        self._wakeup.set()
         return "Quitting..."
 
-    @hotkey('X')
+    @hotkey('X', background=True, resource='queue')
     def clear_queue(self):
         self.stop()
         self.get('status.json', command='pl_empty')
         self._update_status()
+        self._tracks.clear()
+        self._index.clear()
+        self._sync_queue([])
         return "Cleared queue"
 
+    @hotkey('r')
+    def toggle_radio(self):
+        self.radio.enabled = not self.radio.enabled
+        return "Radio on" if self.radio.enabled else "Radio off"
+
     @hotkey(':')
     def enter_command_mode(self):
         self.command_mode.cmdloop()
 
-    @hotkey('p')
+    @hotkey('p', background=True, resource='playlist')
     def add_to_playlist(self):
-        tracks = []
-        if self.playlist.tracks:
-            tracks.extend([{'id': track['id']} for track in self.playlist.tracks])
-        tracks.append({'id': self.current_track['id']})
-        client.put(self.playlist['uri'], playlist={'tracks': tracks})
+        self.playlist.add(self.current_track)
         return "%s added to playlist" % self.current_track
@@ -0,0 +1,16 @@
+import json
+import os
+import tempfile
+
+# silverlining reads its dotfiles from HOME once they're first needed, so
+# point it at a throwaway one before any test imports the package
+HOME = tempfile.mkdtemp(prefix='silverlining-tests-')
+os.environ['HOME'] = HOME
+os.makedirs(os.path.join(HOME, '.silverlining'))
+with open(os.path.join(HOME, '.silverlining', 'config.json'), 'w') as f:
+    json.dump({
+        'client_id': 'test-client-id',
+        'secret_key': 'test-secret',
+        'username': 'test-user',
+        'password': 'test-password',
+    }, f)
@@ -0,0 +1,32 @@
+import pytest
+
+from silverlining.command import CommandMode
+
+
+class Player(object):
+    num_tracks = 10
+
+    def __init__(self, current_idx=None):
+        self._current_idx = current_idx
+
+    @property
+    def current_idx(self):
+        if self._current_idx is None:
+            # like the real player with nothing playing
+            raise ValueError('nothing playing')
+        return self._current_idx
+
+
+def test_parse_range_without_anything_playing():
+    mode = CommandMode(Player())
+    assert mode.parse_range('0') == [0]
+    assert mode.parse_range('0,3-5') == [0, 3, 4, 5]
+    with pytest.raises(ValueError):
+        mode.parse_range('.')
+
+
+def test_parse_range_current_track():
+    mode = CommandMode(Player(current_idx=2))
+    assert mode.parse_range('.') == [2]
+    assert mode.parse_range('.-4') == [2, 3, 4]
+    assert mode.parse_range('8-*') == [8, 9]
@@ -0,0 +1,51 @@
+import os
+
+from silverlining.history import History
+
+
+def entry(i):
+    return {'id': i, 'title': 'track %s' % i, 'username': 'user'}
+
+
+def test_recent_is_newest_first_and_distinct(tmpdir):
+    history = History(str(tmpdir.join('history.jsonl')), max_entries=0)
+    for i in [1, 2, 3, 2, 4]:
+        history.append(entry(i))
+    assert [e['id'] for e in history.recent()] == [4, 2, 3, 1]
+    # read back from disk, not from what was appended this session
+    reopened = History(history.path, max_entries=0)
+    assert [e['id'] for e in reopened.recent(3)] == [4, 2, 3]
+
+
+def test_torn_last_line(tmpdir):
+    path = str(tmpdir.join('history.jsonl'))
+    history = History(path)
+    for i in range(3):
+        history.append(entry(i))
+    # a crash halfway through writing the next line
+    with open(path, 'a') as f:
+        f.write('{"id": 3, "tit')
+
+    history = History(path)
+    assert [e['id'] for e in history.recent()] == [2, 1, 0]
+    history.append(entry(4))
+    reopened = History(path)
+    assert [e['id'] for e in reopened.recent()] == [4, 2, 1, 0]
+
+
+def test_compact_keeps_newest_distinct(tmpdir):
+    path = str(tmpdir.join('history.jsonl'))
+    history = History(path, max_entries=5)
+    with open(path, 'a') as f:
+        f.write('{"id": 99, "tit\n')
+    for i in list(range(20)) + [3, 17]:
+        history.append(entry(i))
+    size = os.path.getsize(path)
+
+    history.compact()
+    assert os.path.getsize(path) < size
+    with open(path) as f:
+        lines = f.read().splitlines()
+    assert len(lines) == 5
+    assert [e['id'] for e in History(path).recent()] == [17, 3, 19, 18, 16]
+    assert [e['id'] for e in history.recent()] == [17, 3, 19, 18, 16]
@@ -0,0 +1,80 @@
+from silverlining.timeline import Timeline
+
+
+def activity(i):
+    return {'type': 'track', 'created_at': str(i), 'track': {'id': i}}
+
+
+def page(ids, next_href=None, future_href=None):
+    return {'collection': [activity(i) for i in ids],
+            'next_href': next_href, 'future_href': future_href}
+
+
+class FakeStream(object):
+    def __init__(self, pages):
+        self.pages = pages
+        self.fetched = []
+
+    def fetch(self, url):
+        self.fetched.append(url)
+        return self.pages[url]
+
+
+def timeline(name, stream):
+    return Timeline(name, 'first?limit=3', stream.fetch, lambda item: item['track'])
+
+
+def ids(tracks):
+    return [t['id'] for t in tracks]
+
+
+def test_pages_back_lazily():
+    stream = FakeStream({
+        'first?limit=3': page([9, 8, 7], 'next1?limit=3', 'future1?limit=3'),
+        'next1?limit=3': page([6, 5], 'next1?limit=3'),
+    })
+    tracks = timeline('lazy', stream).tracks()
+    assert ids(next(tracks) for _ in range(3)) == [9, 8, 7]
+    assert stream.fetched == ['first?limit=3']
+    # a next_href pointing back at itself ends the stream
+    assert ids(tracks) == [6, 5]
+    assert stream.fetched == ['first?limit=3', 'next1?limit=3']
+
+
+def test_refresh_from_future_href():
+    stream = FakeStream({
+        'first?limit=3': page([3, 2, 1], 'next1?limit=3', 'future1?limit=3'),
+        'future1?limit=3': page([5, 4], None, 'future2?limit=3'),
+        'future2?limit=3': page([9, 8, 7], 'next2?limit=3', 'future3?limit=3'),
+    })
+    stored = timeline('future', stream)
+    stored.refresh()
+
+    # fewer than limit new items, they all come before the stored ones
+    stored.state['refreshed'] = 0
+    stored.refresh()
+    assert ids(e['track'] for e in stored.state['items']) == [5, 4, 3, 2, 1]
+    assert stored.state['next_href'] == 'next1?limit=3'
+
+    # a full page may have a gap after it, so it replaces what's stored
+    stored.state['refreshed'] = 0
+    stored.refresh()
+    assert ids(e['track'] for e in stored.state['items']) == [9, 8, 7]
+    assert stored.state['next_href'] == 'next2?limit=3'
+    assert stored.state['future_href'] == 'future3?limit=3'
+
+    # and it's what's on disk
+    reloaded = timeline('future', stream)
+    assert reloaded.state['items'] == stored.state['items']
+
+
+def test_refresh_merges_overlapping_first_page():
+    stream = FakeStream({'first?limit=3': page([3, 2, 1], 'next1?limit=3')})
+    stored = timeline('overlap', stream)
+    stored.refresh()
+
+    stream.pages['first?limit=3'] = page([5, 4, 3], 'next2?limit=3')
+    stored.state['refreshed'] = 0
+    stored.refresh()
+    assert ids(e['track'] for e in stored.state['items']) == [5, 4, 3, 2, 1]
+    assert stored.state['next_href'] == 'next1?limit=3'
@@ -0,0 +1,75 @@
+import random
+
+import pytest
+
+from silverlining.utils import IndexedList, PrefixTrie
+
+
+def test_indexed_list_matches_list():
+    rng = random.Random(0)
+    expected, indexed = [], IndexedList()
+    items = iter(range(10 ** 6))
+    for _ in range(3000):
+        op = rng.random()
+        if op < 0.4 or not expected:
+            i = rng.randint(0, len(expected))
+            item = next(items)
+            expected.insert(i, item)
+            indexed.insert(i, item)
+        elif op < 0.6:
+            i = rng.randrange(len(expected))
+            assert indexed.pop(i) == expected.pop(i)
+        elif op < 0.7:
+            item = rng.choice(expected)
+            expected.remove(item)
+            indexed.remove(item)
+        elif op < 0.85:
+            item = rng.choice(expected)
+            i = rng.randint(0, len(expected) - 1)
+            expected.remove(item)
+            expected.insert(i, item)
+            indexed.move(item, i)
+        else:
+            item = rng.choice(expected)
+            assert indexed.index(item) == expected.index(item)
+
+        assert len(indexed) == len(expected)
+        if expected:
+            i = rng.randrange(len(expected))
+            assert indexed[i] == expected[i]
+            assert indexed[-1] == expected[-1]
+    assert list(indexed) == expected
+    assert indexed[2:10] == expected[2:10]
+
+
+def test_indexed_list_errors():
+    indexed = IndexedList(['a', 'b'])
+    with pytest.raises(ValueError):
+        indexed.insert(0, 'a')
+    with pytest.raises(ValueError):
+        indexed.index('c')
+    with pytest.raises(IndexError):
+        indexed[2]
+    with pytest.raises(IndexError):
+        indexed.pop(5)
+    indexed.clear()
+    assert len(indexed) == 0 and 'a' not in indexed
+
+
+def test_prefix_trie_completes_shortest_first():
+    trie = PrefixTrie(['Patience', 'pat', 'patrol', 'feed'])
+    assert trie.complete('PA') == ['pat', 'patrol', 'Patience']
+    assert trie.complete('pa', limit=2) == ['pat', 'patrol']
+    assert trie.complete('x') == []
+
+
+def test_prefix_trie_counts_and_prunes():
+    trie = PrefixTrie(['pat', 'pat', 'patrol'])
+    trie.remove('pat')
+    assert trie.complete('pat') == ['pat', 'patrol']
+    trie.remove('pat')
+    assert trie.complete('pat') == ['patrol']
+    trie.remove('patrol')
+    trie.remove('missing')
+    assert trie.complete('') == []
+    assert trie._root == {}